@@ -0,0 +1,288 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+usage = """
+Usage: ./batch.py [options] <tool> [tool options]
+
+複数の入力ファイルそれぞれに、同じオプションでツールを実行する。
+  tool: reverse (reverse.py) / ma (copy_add_ma.py) / candle (candle.py)
+  tool options には、各スクリプトのオプションのうち入力・出力ファイル名と -j / --jobs 以外を指定する。
+
+options:
+  -h        / --help               : このヘルプを表示
+  -i <pattern> / --input <pattern> : 入力ファイルを glob のパターンまたはディレクトリで指定 (複数回指定可)
+    ディレクトリの場合は、その中の *.csv / *.csv.gz / *.csv.bz2 / *.csv.xz を入力とする。
+  -o <rule> / --output <rule>      : 出力ファイル名の規則を設定
+    {dir} は入力ファイルのディレクトリ、{name} は入力ファイル名、
+    {stem} は入力ファイル名から圧縮の拡張子と最後の拡張子を除いたものに置き換える。
+    例: -o "out/{stem}-1h.csv" (出力先のディレクトリがなければ作る)
+  -j <num>  / --jobs <num>         : 同時に処理するファイル数を設定 (省略時CPU数)
+  --force                          : 出力ファイルが入力ファイル以降に更新されている場合も処理する
+  --manifest <file>                : 各ファイルの行数・処理時間・エラーなどを JSON 形式で保存する
+    入力・出力の行数はヘッダ行を含むため、ヘッダ行の数が異なる場合はその分だけ差が出る。
+
+大きいファイルから順に処理を始め、最後に大きいファイルだけが残らないようにする。
+出力ファイルが入力ファイル以降に更新されている場合は、そのファイルの処理を省略する。
+処理に失敗したファイルの出力ファイルは削除する。
+終了時に、処理・省略・失敗したファイルの数を標準エラー出力に表示する。
+出力の規則・プロセス数・--manifest は、それぞれ0回か1回のみ設定可能。
+""".strip()
+
+import sys
+import glob
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import column_reader
+import compressed_io
+import stage_io
+
+# ディレクトリを指定した場合に入力とするファイル
+directoryPatterns = ["*.csv", "*.csv.gz", "*.csv.bz2", "*.csv.xz"]
+
+inputPatterns = []
+outputRule = None
+jobs = None
+force = False
+manifestFileName = None
+tool = None
+toolArgs = None
+
+i = 1
+argc = len(sys.argv)
+argv = sys.argv
+try:
+	while i < argc:
+		if argv[i] == '-h' or argv[i] == '--help':
+			print(usage)
+			sys.exit(0)
+		elif argv[i] == '-i' or argv[i] == '--input':
+			if i + 1 >= argc:
+				raise Exception("missing input pattern")
+			i += 1
+			inputPatterns.append(argv[i])
+		elif argv[i] == '-o' or argv[i] == '--output':
+			if outputRule is not None:
+				raise Exception("multiple -o or --output")
+			if i + 1 >= argc:
+				raise Exception("missing output rule")
+			i += 1
+			outputRule = argv[i]
+		elif argv[i] == '-j' or argv[i] == '--jobs':
+			if jobs is not None:
+				raise Exception("multiple -j or --jobs")
+			if i + 1 >= argc:
+				raise Exception("missing number of jobs")
+			i += 1
+			jobs = int(argv[i])
+			if jobs <= 0:
+				raise Exception("number of jobs must be positive")
+		elif argv[i] == '--force':
+			force = True
+		elif argv[i] == '--manifest':
+			if manifestFileName is not None:
+				raise Exception("multiple --manifest")
+			if i + 1 >= argc:
+				raise Exception("missing manifest file name")
+			i += 1
+			manifestFileName = argv[i]
+		elif not argv[i].startswith('-'):
+			tool = argv[i]
+			toolArgs = argv[i + 1:]
+			break
+		else:
+			raise Exception("unknown option " + argv[i])
+		i += 1
+	if tool is None:
+		raise Exception("missing tool")
+	if tool not in stage_io.toolScripts:
+		raise Exception("unknown tool " + tool)
+	if len(inputPatterns) == 0:
+		raise Exception("missing -i or --input")
+	if outputRule is None:
+		raise Exception("missing -o or --output")
+	for x in ['-i', '--input-file', '-o', '--output-file']:
+		if x in toolArgs:
+			raise Exception(x + " cannot be given in tool options")
+	for x in ['-j', '--jobs']:
+		if x in toolArgs:
+			# 各ファイルはプロセスプールの中で処理するため、その中でさらにプロセスを作れない
+			raise Exception(x + " in tool options is not supported in batch mode (use -j before the tool name)")
+	if 'fork' not in multiprocessing.get_all_start_methods():
+		raise Exception("batch mode is not supported on this platform")
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+if jobs is None : jobs = os.cpu_count() or 1
+
+def listInputs(patterns):
+	fileNames = []
+	for pattern in patterns:
+		if os.path.isdir(pattern):
+			matched = [x for p in directoryPatterns for x in glob.glob(os.path.join(glob.escape(pattern), p))]
+		else:
+			matched = glob.glob(pattern)
+		fileNames.extend(sorted(x for x in matched if os.path.isfile(x)))
+	# 同じファイルを複数のパターンで指定した場合は1回のみ処理する
+	ret = []
+	seen = set()
+	for x in fileNames:
+		if os.path.abspath(x) not in seen:
+			seen.add(os.path.abspath(x))
+			ret.append(x)
+	return ret
+
+def outputName(inputName):
+	name = os.path.basename(inputName)
+	stem = name
+	if os.path.splitext(stem)[1] in compressed_io.compressExtensions:
+		stem = os.path.splitext(stem)[0]
+	stem = os.path.splitext(stem)[0]
+	return outputRule.format(dir=os.path.dirname(inputName) or ".", name=name, stem=stem)
+
+def isUpToDate(inputName, outputName):
+	try:
+		return os.stat(outputName).st_mtime_ns >= os.stat(inputName).st_mtime_ns
+	except OSError:
+		return False
+
+def countRecords(fileName):
+	# ファイルの行数を数える (ヘッダ行を含み、" で囲まれた列の中の改行は行の区切りとしない)
+	count = 0
+	last = 0
+	with compressed_io.openInput(fileName) as f:
+		for last in column_reader.recordEnds(f):
+			count += 1
+		# 改行で終わっていない最後の行も数える
+		if f.tell() > last:
+			count += 1
+	return count
+
+def runJob(job):
+	# プールのプロセスで1個のファイルを処理し、結果を返す
+	# ツールが標準エラー出力に書いた内容は、一時ファイルに受けて結果に含める
+	inputName, outputName = job
+	result = {"input": inputName, "output": outputName, "inputBytes": os.path.getsize(inputName)}
+	script = stage_io.scriptPath(tool)
+	outputDir = os.path.dirname(outputName)
+	started = time.perf_counter()
+	with tempfile.TemporaryFile() as errorFile:
+		sys.stderr.flush()
+		savedError = os.dup(2)
+		os.dup2(errorFile.fileno(), 2)
+		try:
+			if outputDir != '':
+				os.makedirs(outputDir, exist_ok=True)
+			exitCode = stage_io.runScript(script, stage_io.Stage([script] + toolArgs + ['-i', inputName, '-o', outputName], chained=False))
+		except Exception as e:
+			sys.stderr.write('error: ' + str(e) + '\n')
+			exitCode = 1
+		finally:
+			sys.stderr.flush()
+			os.dup2(savedError, 2)
+			os.close(savedError)
+		errorFile.seek(0)
+		messages = errorFile.read().decode('utf-8', 'replace').strip()
+	result["seconds"] = time.perf_counter() - started
+	result["exitCode"] = exitCode
+	if messages != '':
+		result["messages"] = messages
+	if exitCode != 0:
+		result["status"] = "failed"
+		# 途中までの出力が、次回に処理済みとして扱われないようにする
+		if os.path.isfile(outputName):
+			os.remove(outputName)
+		return result
+	result["status"] = "done"
+	try:
+		result["inputRows"] = countRecords(inputName)
+		result["outputRows"] = countRecords(outputName)
+	except Exception as e:
+		result["messages"] = (messages + '\n' if messages != '' else '') + 'counting rows failed: ' + str(e)
+	return result
+
+started = time.perf_counter()
+try:
+	inputNames = listInputs(inputPatterns)
+	if len(inputNames) == 0:
+		raise Exception("no input files")
+	jobList = [(x, outputName(x)) for x in inputNames]
+	outputPaths = set(os.path.abspath(x[1]) for x in jobList)
+	if len(outputPaths) != len(jobList):
+		raise Exception("output rule gives the same output file name to multiple inputs")
+	if any(os.path.abspath(x) in outputPaths for x in inputNames):
+		raise Exception("output rule gives an input file name")
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+results = []
+pending = []
+for inputName, outputName in jobList:
+	if not force and isUpToDate(inputName, outputName):
+		results.append({"input": inputName, "output": outputName, "status": "skipped"})
+	else:
+		pending.append((inputName, outputName))
+# 大きいファイルから順に処理する
+pending.sort(key=lambda x: os.path.getsize(x[0]), reverse=True)
+
+if len(pending) > 0:
+	with multiprocessing.get_context('fork').Pool(min(jobs, len(pending))) as pool:
+		for result in pool.imap_unordered(runJob, pending):
+			if result["status"] == "failed":
+				sys.stderr.write('failed: {0}: {1}\n'.format(result["input"], result.get("messages", "exit code {0}".format(result["exitCode"]))))
+			results.append(result)
+
+counts = {status: sum(1 for x in results if x["status"] == status) for status in ["done", "skipped", "failed"]}
+elapsed = time.perf_counter() - started
+sys.stderr.write('done: {0}, skipped: {1}, failed: {2}, elapsed: {3:.3f} s\n'.format(counts["done"], counts["skipped"], counts["failed"], elapsed))
+
+if manifestFileName is not None:
+	order = {x: k for k, x in enumerate(inputNames)}
+	results.sort(key=lambda x: order[x["input"]])
+	manifest = {
+		"tool": tool,
+		"toolArgs": toolArgs,
+		"jobs": jobs,
+		"elapsed": elapsed,
+		"done": counts["done"],
+		"skipped": counts["skipped"],
+		"failed": counts["failed"],
+		"files": results,
+	}
+	try:
+		with open(manifestFileName, 'w', encoding='utf-8') as f:
+			json.dump(manifest, f, ensure_ascii=False, indent=1)
+			f.write('\n')
+	except Exception as e:
+		sys.stderr.write('error: ' + str(e) + '\n')
+		sys.exit(1)
+
+sys.exit(1 if counts["failed"] > 0 else 0)
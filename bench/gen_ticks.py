@@ -0,0 +1,199 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+usage = """
+Usage: ./gen_ticks.py [options]
+
+options:
+  -h        / --help               : このヘルプを表示
+
+  -o <file> / --output-file <file> : 出力ファイル名を設定 (省略時標準出力)
+  --output-encode <encode>         : 出力文字コードを設定 (省略時 utf-8)
+
+  -r <num> / --rows <num>          : 出力するデータの行数を設定 (省略時100000)
+  -c <num> / --columns <num>       : 出力する列数を設定 (省略時4、最小4)
+  --date <format>                  : 時刻の形式を設定 (省略時 %Y/%m/%d %H:%M:%S )
+  --start <date>                   : 最初の時刻を --date の形式で設定 (省略時 2020/01/06 09:00:00)
+  --max-step <sec>                 : 隣り合う行の時刻の差の最大値(秒)を設定 (省略時10)
+  --quote-ratio <ratio>            : 改行やカンマを含む引用符付きの列を出力する割合 (省略時0)
+  --seed <num>                     : 乱数の種を設定 (省略時0)
+  --no-header                      : ヘッダ行を出力しない
+
+時刻・値・出来高・市場・(残りは埋め草) の順に列を出力する。
+値は2桁の小数を基本とし、一部の行は整数になる。
+同じ種と設定からは、常に同じ内容が出力される。
+各オプションは、それぞれ0回か1回のみ設定可能。
+""".strip()
+
+import sys
+import csv
+import datetime
+import random
+
+outputFileName = None
+outputEncode = None
+rows = None
+columns = None
+dateFormat = None
+start = None
+maxStep = None
+quoteRatio = None
+seed = None
+header = True
+
+i = 1
+argc = len(sys.argv)
+argv = sys.argv
+try:
+	while i < argc:
+		if argv[i] == '-h' or argv[i] == '--help':
+			print(usage)
+			sys.exit(0)
+		elif argv[i] == '-o' or argv[i] == '--output-file':
+			if outputFileName is not None:
+				raise Exception("multiple -o or --output-file")
+			if i + 1 >= argc:
+				raise Exception("missing output file name")
+			i += 1
+			outputFileName = argv[i]
+		elif argv[i] == '--output-encode':
+			if outputEncode is not None:
+				raise Exception("multiple --output-encode")
+			if i + 1 >= argc:
+				raise Exception("missing output encoding")
+			i += 1
+			outputEncode = argv[i]
+		elif argv[i] == '-r' or argv[i] == '--rows':
+			if rows is not None:
+				raise Exception("multiple -r or --rows")
+			if i + 1 >= argc:
+				raise Exception("missing row count")
+			i += 1
+			rows = int(argv[i])
+			if rows < 0:
+				raise Exception("row count must be non-negative")
+		elif argv[i] == '-c' or argv[i] == '--columns':
+			if columns is not None:
+				raise Exception("multiple -c or --columns")
+			if i + 1 >= argc:
+				raise Exception("missing column count")
+			i += 1
+			columns = int(argv[i])
+			if columns < 4:
+				raise Exception("column count must be at least 4")
+		elif argv[i] == '--date':
+			if dateFormat is not None:
+				raise Exception("multiple --date")
+			if i + 1 >= argc:
+				raise Exception("missing date format")
+			i += 1
+			dateFormat = argv[i]
+		elif argv[i] == '--start':
+			if start is not None:
+				raise Exception("multiple --start")
+			if i + 1 >= argc:
+				raise Exception("missing start date")
+			i += 1
+			start = argv[i]
+		elif argv[i] == '--max-step':
+			if maxStep is not None:
+				raise Exception("multiple --max-step")
+			if i + 1 >= argc:
+				raise Exception("missing max step")
+			i += 1
+			maxStep = int(argv[i])
+			if maxStep < 0:
+				raise Exception("max step must be non-negative")
+		elif argv[i] == '--quote-ratio':
+			if quoteRatio is not None:
+				raise Exception("multiple --quote-ratio")
+			if i + 1 >= argc:
+				raise Exception("missing quote ratio")
+			i += 1
+			quoteRatio = float(argv[i])
+			if quoteRatio < 0 or 1 < quoteRatio:
+				raise Exception("quote ratio must be between 0 and 1")
+		elif argv[i] == '--seed':
+			if seed is not None:
+				raise Exception("multiple --seed")
+			if i + 1 >= argc:
+				raise Exception("missing seed")
+			i += 1
+			seed = int(argv[i])
+		elif argv[i] == '--no-header':
+			header = False
+		else:
+			raise Exception("unknown option " + argv[i])
+		i += 1
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+if outputEncode is None: outputEncode = "utf-8"
+if rows is None: rows = 100000
+if columns is None: columns = 4
+if dateFormat is None: dateFormat = "%Y/%m/%d %H:%M:%S"
+if maxStep is None: maxStep = 10
+if quoteRatio is None: quoteRatio = 0.0
+if seed is None: seed = 0
+
+try:
+	date = datetime.datetime.strptime(start, dateFormat) if start is not None else datetime.datetime(2020, 1, 6, 9, 0, 0)
+except ValueError as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+outputFile = open(outputFileName, 'w', newline='', encoding=outputEncode) if outputFileName is not None else sys.stdout
+if outputFileName is None:
+	sys.stdout.reconfigure(newline='', encoding=outputEncode)
+csvWriter = csv.writer(outputFile)
+
+rand = random.Random(seed)
+venues = ["東証", "大証", "名証", "PTS"]
+fillers = ["abc", "注文", "12345", "x-y-z", ""]
+
+if header:
+	csvWriter.writerow(["time", "price", "volume", "venue"] + ["col{0}".format(k) for k in range(5, columns + 1)])
+
+price = 10000
+for lineNo in range(rows):
+	date += datetime.timedelta(seconds=rand.randint(0, maxStep))
+	price = max(1, price + rand.randint(-50, 50))
+	row = [
+		date.strftime(dateFormat),
+		price // 100 if rand.random() < 0.1 else "{0}.{1:02d}".format(price // 100, price % 100),
+		rand.randint(1, 100) * 100,
+		rand.choice(venues),
+	]
+	for k in range(4, columns):
+		if rand.random() < quoteRatio:
+			row.append(rand.choice(["a,b", "line1\nline2", "say \"hi\""]))
+		else:
+			row.append(rand.choice(fillers))
+	csvWriter.writerow(row)
+
+if outputFileName is not None:
+	outputFile.close()
@@ -0,0 +1,277 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+usage = """
+Usage: ./run_bench.py [options]
+
+options:
+  -h        / --help               : このヘルプを表示
+
+  -o <file> / --output-file <file> : 結果を JSON で出力するファイル名を設定 (省略時標準出力)
+  -b <file> / --baseline <file>    : 比較の基準とする結果ファイルを設定
+  --threshold <ratio>              : 基準より遅い・メモリを使うとみなす割合を設定 (省略時0.1)
+
+  -r <num> / --rows <num>          : 生成する入力データの行数を設定 (省略時200000)
+  --repeat <num>                   : 各ケースを実行する回数を設定 (省略時1、最も速かった回を記録)
+  --filter <text>                  : 名前に指定した文字列を含むケースのみ実行する
+  --work-dir <dir>                 : 生成した入力データを置くディレクトリを設定 (省略時一時ディレクトリ)
+  --list                           : ケースの一覧を表示して終了
+
+各ケースについて、実行時間・1秒あたりの処理行数・最大使用メモリ(RSS)を記録する。
+基準を指定した場合は結果と比較し、閾値を超えて悪化したケースがあれば終了コード2で終了する。
+入力データは gen_ticks.py で生成し、同じ行数であれば常に同じ内容となる。
+--filter 以外の各オプションは、それぞれ0回か1回のみ設定可能。
+""".strip()
+
+import sys
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+toolDir = os.path.dirname(benchDir)
+
+# 入力データ名: gen_ticks.py に渡すオプション
+inputs = {
+	"ticks": [],
+	"ticks-wide": ["--columns", "40"],
+	"ticks-cp932": ["--output-encode", "cp932"],
+	"ticks-iso": ["--date", "%Y-%m-%dT%H:%M:%S"],
+	"ticks-text-month": ["--date", "%d %b %Y %H:%M:%S"],
+	"ticks-quoted": ["--columns", "8", "--quote-ratio", "0.05"],
+}
+
+# ケース名: (ツール, 入力データ名, オプション)
+cases = []
+for span in ["month", "week", "day", "1h", "5m", "1s"]:
+	cases.append(("candle-" + span, "candle.py", "ticks", ["--header", "1", "-s", span]))
+cases += [
+	("candle-day-wide", "candle.py", "ticks-wide", ["--header", "1"]),
+	("candle-day-cp932", "candle.py", "ticks-cp932", ["--header", "1", "--input-encode", "cp932"]),
+	("candle-day-iso", "candle.py", "ticks-iso", ["--header", "1", "--input-date", "%Y-%m-%dT%H:%M:%S"]),
+	("candle-day-strptime", "candle.py", "ticks-text-month", ["--header", "1", "--input-date", "%d %b %Y %H:%M:%S"]),
+	("candle-day-quoted", "candle.py", "ticks-quoted", ["--header", "1"]),
+	("candle-day-jobs2", "candle.py", "ticks", ["--header", "1", "-j", "2"]),
+	("ma-copy-sum", "copy_add_ma.py", "ticks", ["--header", "1", "-l", "-c", "1", "-s", "3"]),
+	("ma-smooth", "copy_add_ma.py", "ticks", ["--header", "1", "--smooth", "2", "0.1"]),
+	("ma-all", "copy_add_ma.py", "ticks", ["--header", "1", "-c", "1", "-s", "3", "-a", "2", "5", "-a", "2", "500", "--smooth", "2", "0.1"]),
+	("ma-wide", "copy_add_ma.py", "ticks-wide", ["--header", "1", "-c", "1", "-a", "2", "50"]),
+	("ma-cp932", "copy_add_ma.py", "ticks-cp932", ["--header", "1", "--input-encode", "cp932", "-c", "4", "-a", "2", "50"]),
+]
+for width in [5, 50, 500, 5000, 50000]:
+	cases.append(("ma-width-{0}".format(width), "copy_add_ma.py", "ticks", ["--header", "1", "-a", "2", str(width)]))
+	cases.append(("ma-width-{0}-batch".format(width), "copy_add_ma.py", "ticks", ["--header", "1", "-a", "2", str(width), "--batch", "65536"]))
+cases += [
+	("reverse", "reverse.py", "ticks", ["--header", "1"]),
+	("reverse-wide", "reverse.py", "ticks-wide", ["--header", "1"]),
+	("reverse-block", "reverse.py", "ticks", ["--header", "1", "--block-size", "1048576"]),
+	("reverse-block-quoted", "reverse.py", "ticks-quoted", ["--header", "1", "--block-size", "1048576"]),
+]
+
+outputFileName = None
+baselineFileName = None
+threshold = None
+rows = None
+repeat = None
+filters = []
+workDir = None
+listOnly = False
+
+i = 1
+argc = len(sys.argv)
+argv = sys.argv
+try:
+	while i < argc:
+		if argv[i] == '-h' or argv[i] == '--help':
+			print(usage)
+			sys.exit(0)
+		elif argv[i] == '-o' or argv[i] == '--output-file':
+			if outputFileName is not None:
+				raise Exception("multiple -o or --output-file")
+			if i + 1 >= argc:
+				raise Exception("missing output file name")
+			i += 1
+			outputFileName = argv[i]
+		elif argv[i] == '-b' or argv[i] == '--baseline':
+			if baselineFileName is not None:
+				raise Exception("multiple -b or --baseline")
+			if i + 1 >= argc:
+				raise Exception("missing baseline file name")
+			i += 1
+			baselineFileName = argv[i]
+		elif argv[i] == '--threshold':
+			if threshold is not None:
+				raise Exception("multiple --threshold")
+			if i + 1 >= argc:
+				raise Exception("missing threshold")
+			i += 1
+			threshold = float(argv[i])
+			if threshold < 0:
+				raise Exception("threshold must be non-negative")
+		elif argv[i] == '-r' or argv[i] == '--rows':
+			if rows is not None:
+				raise Exception("multiple -r or --rows")
+			if i + 1 >= argc:
+				raise Exception("missing row count")
+			i += 1
+			rows = int(argv[i])
+			if rows <= 0:
+				raise Exception("row count must be positive")
+		elif argv[i] == '--repeat':
+			if repeat is not None:
+				raise Exception("multiple --repeat")
+			if i + 1 >= argc:
+				raise Exception("missing repeat count")
+			i += 1
+			repeat = int(argv[i])
+			if repeat <= 0:
+				raise Exception("repeat count must be positive")
+		elif argv[i] == '--filter':
+			if i + 1 >= argc:
+				raise Exception("missing filter")
+			i += 1
+			filters.append(argv[i])
+		elif argv[i] == '--work-dir':
+			if workDir is not None:
+				raise Exception("multiple --work-dir")
+			if i + 1 >= argc:
+				raise Exception("missing work directory")
+			i += 1
+			workDir = argv[i]
+		elif argv[i] == '--list':
+			listOnly = True
+		else:
+			raise Exception("unknown option " + argv[i])
+		i += 1
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+if threshold is None: threshold = 0.1
+if rows is None: rows = 200000
+if repeat is None: repeat = 1
+
+selectedCases = [c for c in cases if len(filters) == 0 or any(f in c[0] for f in filters)]
+
+if listOnly:
+	for name, tool, inputName, args in selectedCases:
+		print(name + ": " + " ".join([tool] + args + ["-i", inputName]))
+	sys.exit(0)
+
+baseline = None
+if baselineFileName is not None:
+	try:
+		with open(baselineFileName, 'r') as f:
+			baseline = {c["name"]: c for c in json.load(f)["cases"]}
+	except (OSError, ValueError, KeyError) as e:
+		sys.stderr.write('error: failed to read baseline: ' + str(e) + '\n')
+		sys.exit(1)
+
+def run(args, inputFileName):
+	# 子プロセスごとの最大使用メモリを得るため、os.wait4 で終了を待つ
+	args = args + ["-i", inputFileName]
+	with open(os.devnull, 'wb') as outputFile:
+		begin = time.perf_counter()
+		process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=outputFile, stderr=subprocess.PIPE)
+		errors = process.stderr.read()
+		_, status, rusage = os.wait4(process.pid, 0)
+		wall = time.perf_counter() - begin
+		process.returncode = os.waitstatus_to_exitcode(status)
+		process.stderr.close()
+	if process.returncode != 0:
+		raise Exception("{0} failed: {1}".format(" ".join(args), errors.decode(errors='replace').strip()))
+	# ru_maxrss の単位は macOS ではバイト、それ以外では KiB
+	peakRss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+	return wall, peakRss
+
+results = []
+try:
+	with tempfile.TemporaryDirectory() as tempDir:
+		dataDir = workDir if workDir is not None else tempDir
+		os.makedirs(dataDir, exist_ok=True)
+		inputFileNames = {}
+		for inputName in sorted(set(c[2] for c in selectedCases)):
+			fileName = os.path.join(dataDir, "{0}-{1}.csv".format(inputName, rows))
+			if not os.path.exists(fileName):
+				sys.stderr.write("generating {0}\n".format(fileName))
+				subprocess.run([sys.executable, os.path.join(benchDir, "gen_ticks.py"), "-r", str(rows), "-o", fileName] + inputs[inputName], check=True)
+			inputFileNames[inputName] = fileName
+		for name, tool, inputName, args in selectedCases:
+			best = None
+			for k in range(repeat):
+				wall, peakRss = run([sys.executable, os.path.join(toolDir, tool)] + args, inputFileNames[inputName])
+				if best is None or wall < best[0]:
+					best = (wall, peakRss)
+			wall, peakRss = best
+			results.append({
+				"name": name,
+				"tool": tool,
+				"input": inputName,
+				"args": args,
+				"rows": rows,
+				"wall": wall,
+				"rowsPerSec": rows / wall if wall > 0 else None,
+				"peakRss": peakRss,
+			})
+			sys.stderr.write("{0:<24} {1:8.3f} s {2:12.0f} rows/s {3:8.1f} MiB\n".format(name, wall, rows / wall if wall > 0 else 0, peakRss / 1024 / 1024))
+except (Exception, subprocess.CalledProcessError) as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+report = {
+	"python": platform.python_version(),
+	"platform": platform.platform(),
+	"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+	"cases": results,
+}
+if outputFileName is not None:
+	with open(outputFileName, 'w') as f:
+		json.dump(report, f, indent=1)
+		f.write('\n')
+else:
+	json.dump(report, sys.stdout, indent=1)
+	sys.stdout.write('\n')
+
+if baseline is not None:
+	regressions = 0
+	sys.stderr.write("\n{0:<24} {1:>9} {2:>9} {3:>9}\n".format("name", "time", "rss", ""))
+	for c in results:
+		base = baseline.get(c["name"])
+		if base is None or base.get("rows") != c["rows"]:
+			sys.stderr.write("{0:<24} {1:>9} {2:>9}\n".format(c["name"], "-", "-"))
+			continue
+		timeRatio = c["wall"] / base["wall"] if base["wall"] > 0 else 1.0
+		rssRatio = c["peakRss"] / base["peakRss"] if base["peakRss"] > 0 else 1.0
+		slower = timeRatio > 1.0 + threshold or rssRatio > 1.0 + threshold
+		if slower:
+			regressions += 1
+		sys.stderr.write("{0:<24} {1:8.2f}x {2:8.2f}x {3:>9}\n".format(c["name"], timeRatio, rssRatio, "WORSE" if slower else ""))
+	if regressions > 0:
+		sys.stderr.write("{0} case(s) worse than baseline\n".format(regressions))
+		sys.exit(2)
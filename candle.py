@@ -31,79 +31,160 @@ options:
   -h        / --help                : このヘルプを表示
 
   -i <file> / --input-file <file>  : 入力ファイル名を設定 (省略時標準入力)
+    複数回指定すると、それぞれ時刻の昇順に並んだ入力を、時刻の順にマージしながら集計する。
+    同じ時刻の入力は、指定した順に集計する。
+    --jobs / --state / --cache / --build-index とは同時に指定できない。
   -o <file> / --output-file <file> : 出力ファイル名を設定 (省略時標準出力)
+    間隔を複数指定する場合は、同じ数だけ指定し、指定した順に各間隔の出力先となる。
   --input-encode <encode>          : 入力文字コードを設定 (省略時システム標準)
   --output-encode <encode>         : 出力文字コードを設定 (省略時システム標準)
+  --compress-level <num>           : 圧縮して出力する場合の圧縮レベルを設定 (0～9、省略時 gzip / xz は6、bzip2 は9)
+    入力ファイルが gzip / bzip2 / xz で圧縮されている場合は、別のスレッドで展開しながら読み込む。
+    出力ファイル名の拡張子が .gz / .bz2 / .xz の場合は、別のスレッドで圧縮しながら書き出す。
 
   --header <num>                   : ヘッダ行数を設定 (省略時0)
 
   -t <col-num> / --time <col-num>  : 時刻が格納された行を指定 (省略時1)
   -v <col-num> / --value <col-num> : 値が格納された行を指定 (省略時2)
+  -g <col-num> / --group <col-num> : 銘柄が格納された行を指定 (省略時、全体を1つの銘柄として扱う)
+    指定すると、銘柄ごとに足を作り、日時の次の列に銘柄を出力する。
+    時刻は銘柄に関わらず全体で昇順である必要があり、同じ日時の足は銘柄が初めて現れた順に出力する。
+    --jobs / --state / --cache とは同時に指定できない。
+
+  --max-lateness <value>           : 時刻が前後した入力を許容する範囲を指定 (省略時、前後した入力はエラー)
+    value: (整数)h / (整数)m / (整数)s
+    それまでの最も新しい時刻からこの範囲内の入力は、時刻の順に並べ直して集計する。
+    始値は最も早い時刻の値、終値は最も遅い時刻の値とする。
+    既に出力した足に入る入力は集計せず、その数を最後に標準エラー出力に表示する。
+    --group / --jobs / --state とは同時に指定できない。
 
   -s <value> / --span <value>      : 計算を行う間隔を指定 (省略時day)
     value: month / week / day / (整数)h / (整数)m / (整数)s
+    複数回指定すると、入力を1回読むだけで各間隔の足をまとめて出力する。
+    このとき、細かい間隔の足から粗い間隔の足を作るため、
+    全ての間隔は、最も細かい間隔の足を組み合わせて作れる必要がある。
+    (例: 1m と 5m と day と week は可、week と month の組み合わせは不可)
   --week-start <value>             : 週足の開始日を指定 (省略時sun)
     value: sun / mon / tue / wed / thu / fri / sat
 
+  -j <num> / --jobs <num>          : 指定した数のプロセスで並列に集計する (省略時1)
+    入力ファイル名の指定が必要。
+  --state <file>                   : 前回の続きから集計し、次回のための状態を保存する
+    入力ファイルの前回までに処理した部分は読まず、追加された部分のみを集計し、
+    出力ファイルの最後の足 (未確定の足) を書き直して続きを追記する。
+    末尾の改行で終わっていない行は、次回まで処理しない。
+    入力ファイル名と出力ファイル名の指定が必要。
+  --cache                          : 時刻と値の列を解析した結果を保存し、次回以降はそれを読み込む
+    解析結果は入力ファイルと同じ場所の (入力ファイル名).colcache ディレクトリに保存し、
+    入力ファイルのサイズ・更新時刻や、文字コード・ヘッダ行数・列・日時形式が変わると作り直す。
+    保存した結果を読み込むときは、--jobs を指定しても並列処理は行わない。
+    入力ファイル名の指定が必要。--state とは同時に指定できない。
+
+  --from <date>                    : 指定した日時以降の入力のみを集計する (--input-date の形式で指定)
+  --to <date>                      : 指定した日時より前の入力のみを集計する (--input-date の形式で指定)
+    入力ファイルの時刻の索引 (--build-index) があれば、それを使って集計の開始位置を探す。
+    なければ入力ファイル内を二分探索する (このとき、改行を含む列がないことを前提とする)。
+    --to の日時以降の入力を読んだ時点で、残りの入力は読まずに終了する。
+    --jobs / --state / --cache / --max-lateness とは同時に指定できない。
+  --build-index                    : 入力ファイルの時刻の索引を作成して終了する
+    索引は入力ファイルと同じ場所の (入力ファイル名).tidx に保存し、
+    入力ファイルのサイズ・更新時刻や、文字コード・ヘッダ行数・時刻の列・日時形式が変わると使わなくなる。
+    入力ファイル名の指定が必要。圧縮された入力ファイルには使えない。
+  --index-interval <num>           : 索引に記録する行の間隔を設定 (省略時4096)
+
+  --decimals <num>                 : 値を小数点以下の桁数が num 桁の固定小数点数として扱う
+    値を 10 の num 乗倍した整数で集計するため、浮動小数点数の誤差が出ず、常に num 桁の小数として出力する。
+    小数点以下の桁数が num 桁を超える値 (末尾の0を除く) はエラーとする。
+
+  --pipelined                      : 読み込みと書き込みを別のスレッドで行い、集計と並行して進める
+    入力ファイルが複数の場合は、各入力ファイルの読み込みと解析をそれぞれ別のスレッドで行う。
+    --jobs / --state とは同時に指定できない。
+  --stats                          : 処理にかかった時間や件数などを標準エラー出力に表示する
+    読み込み・日時の解析・値の解析・区切りの計算・日時の出力形式への変換・書き込みの
+    各段階の時間と、ピーク時の使用メモリ量などを表示する。
+    --jobs 指定時は、並列に処理した部分の各段階の時間は含まない。
+  --stats-file <file>              : --stats の結果を JSON 形式でファイルに保存する
+  --stats-sample <ms>              : --stats の結果に、指定した間隔 (CPU 時間) で記録した実行中の箇所を加える
+
   --input-date <format> : 入力の日時形式を指定 (省略時 %Y/%m/%d %H:%M:%S )
   --output-date <format> : 出力の日時形式を指定
     (省略時、間隔が month / week / day のとき %Y/%m/%d )
     (省略時、間隔が それ以外           のとき %Y/%m/%d %H:%M:%S )
 
-各オプションは、それぞれ0回か1回のみ設定可能。
+-i と -s と -o 以外の各オプションは、それぞれ0回か1回のみ設定可能。
 列の指定は一番左の列を1列目とする。
 """.strip()
 
-def toValue(inStr):
-	ret = None
-	try:
-		ret = int(inStr)
-	except ValueError:
-		try:
-			ret = float(inStr)
-		except ValueError:
-			pass
-	return ret
-
 import sys
 import codecs
 import csv
 import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import locale
+import multiprocessing
+import operator
+import os
+
+import column_cache
+import compressed_io
+import column_reader
+import time_index
+import pipeline
+import run_stats
+import stage_io
+import value_parser
 
-inputFileName = None
-outputFileName = None
+inputFileNames = []
+outputFileNames = []
 inputEncode = None
 outputEncode = None
 headerNum = None
 timeCol = None
 valueCol = None
-span = None
+groupCol = None
+spans = []
 weekStart = None
 inputDate = None
 outputDate = None
+jobs = None
+stateFileName = None
+useCache = False
+maxLateness = None
+statsEnabled = False
+statsFileName = None
+statsSample = None
+compressLevel = None
+pipelined = False
+fromDate = None
+toDate = None
+buildIndex = False
+indexInterval = None
+decimals = None
+
+# chain.py の段として動く場合は、その段のオプションと前後の段との受け渡しを使う
+stage = stage_io.current()
 
 i = 1
-argc = len(sys.argv)
-argv = sys.argv
+argv = sys.argv if stage is None else stage.argv
+argc = len(argv)
 try:
 	while i < argc:
 		if argv[i] == '-h' or argv[i] == '--help':
 			print(usage)
 			sys.exit(0)
 		elif argv[i] == '-i' or argv[i] == '--input-file':
-			if inputFileName is not None:
-				raise Exception("multiple -i or --input-file")
 			if i + 1 >= argc:
 				raise Exception("missing input file name")
 			i += 1
-			inputFileName = argv[i]
+			inputFileNames.append(argv[i])
 		elif argv[i] == '-o' or argv[i] == '--output-file':
-			if outputFileName is not None:
-				raise Exception("multiple -o or --output-file")
 			if i + 1 >= argc:
 				raise Exception("missing output file name")
 			i += 1
-			outputFileName = argv[i]
+			outputFileNames.append(argv[i])
 		elif argv[i] == '--input-encode':
 			if inputEncode is not None:
 				raise Exception("multiple --input-encode")
@@ -145,13 +226,20 @@ try:
 			valueCol = int(argv[i])
 			if valueCol <= 0:
 				raise Exception("value column must be positive")
+		elif argv[i] == '-g' or argv[i] == '--group':
+			if groupCol is not None:
+				raise Exception("multiple -g or --group")
+			if i + 1 >= argc:
+				raise Exception("missing group column")
+			i += 1
+			groupCol = int(argv[i])
+			if groupCol <= 0:
+				raise Exception("group column must be positive")
 		elif argv[i] == '-s' or argv[i] == '--span':
-			if span is not None:
-				raise Exception("multiple -s or --span")
 			if i + 1 >= argc:
 				raise Exception("missing span")
 			i += 1
-			span = argv[i]
+			spans.append(argv[i])
 		elif argv[i] == '--week-start':
 			if weekStart is not None:
 				raise Exception("multiple --week-start")
@@ -173,20 +261,145 @@ try:
 				raise Exception("missing output date format")
 			i += 1
 			outputDate = argv[i]
+		elif argv[i] == '-j' or argv[i] == '--jobs':
+			if jobs is not None:
+				raise Exception("multiple -j or --jobs")
+			if i + 1 >= argc:
+				raise Exception("missing job count")
+			i += 1
+			jobs = int(argv[i])
+			if jobs <= 0:
+				raise Exception("job count must be positive")
+		elif argv[i] == '--state':
+			if stateFileName is not None:
+				raise Exception("multiple --state")
+			if i + 1 >= argc:
+				raise Exception("missing state file name")
+			i += 1
+			stateFileName = argv[i]
+		elif argv[i] == '--cache':
+			useCache = True
+		elif argv[i] == '--max-lateness':
+			if maxLateness is not None:
+				raise Exception("multiple --max-lateness")
+			if i + 1 >= argc:
+				raise Exception("missing max lateness")
+			i += 1
+			maxLateness = argv[i]
+		elif argv[i] == '--compress-level':
+			if compressLevel is not None:
+				raise Exception("multiple --compress-level")
+			if i + 1 >= argc:
+				raise Exception("missing compression level")
+			i += 1
+			compressLevel = int(argv[i])
+			if compressLevel < 0 or 9 < compressLevel:
+				raise Exception("compression level must be between 0 and 9")
+		elif argv[i] == '--from':
+			if fromDate is not None:
+				raise Exception("multiple --from")
+			if i + 1 >= argc:
+				raise Exception("missing date for --from")
+			i += 1
+			fromDate = argv[i]
+		elif argv[i] == '--to':
+			if toDate is not None:
+				raise Exception("multiple --to")
+			if i + 1 >= argc:
+				raise Exception("missing date for --to")
+			i += 1
+			toDate = argv[i]
+		elif argv[i] == '--build-index':
+			buildIndex = True
+		elif argv[i] == '--index-interval':
+			if indexInterval is not None:
+				raise Exception("multiple --index-interval")
+			if i + 1 >= argc:
+				raise Exception("missing index interval")
+			i += 1
+			indexInterval = int(argv[i])
+			if indexInterval <= 0:
+				raise Exception("index interval must be positive")
+		elif argv[i] == '--decimals':
+			if decimals is not None:
+				raise Exception("multiple --decimals")
+			if i + 1 >= argc:
+				raise Exception("missing decimal places")
+			i += 1
+			decimals = int(argv[i])
+			if decimals < 0:
+				raise Exception("decimal places must be non-negative")
+		elif argv[i] == '--pipelined':
+			pipelined = True
+		elif argv[i] == '--stats':
+			statsEnabled = True
+		elif argv[i] == '--stats-file':
+			if statsFileName is not None:
+				raise Exception("multiple --stats-file")
+			if i + 1 >= argc:
+				raise Exception("missing stats file name")
+			i += 1
+			statsFileName = argv[i]
+			statsEnabled = True
+		elif argv[i] == '--stats-sample':
+			if statsSample is not None:
+				raise Exception("multiple --stats-sample")
+			if i + 1 >= argc:
+				raise Exception("missing sampling interval")
+			i += 1
+			statsSample = float(argv[i])
+			if statsSample <= 0:
+				raise Exception("sampling interval must be positive")
+			statsEnabled = True
 		else:
 			raise Exception("unknown option " + argv[i])
 		i += 1
+	if len(outputFileNames) > 1 and len(outputFileNames) != len(spans):
+		raise Exception("-o or --output-file must be given once for each -s or --span")
+	if len(spans) > 1 and len(outputFileNames) != len(spans):
+		raise Exception("-o or --output-file must be given once for each -s or --span")
+	if len(inputFileNames) > 1 and ((jobs is not None and jobs > 1) or stateFileName is not None or useCache or buildIndex):
+		raise Exception("multiple -i or --input-file cannot be used with --jobs, --state, --cache or --build-index")
+	stage_io.checkOptions(stage, len(inputFileNames) > 0 or inputEncode is not None,
+		len(outputFileNames) > 0 or outputEncode is not None or compressLevel is not None, pipelined, statsSample)
+	if stage is not None and stage.chained and jobs is not None and jobs > 1:
+		# 子プロセスに渡す関数を、段として実行したスクリプトの名前空間から引けないため
+		raise Exception("--jobs cannot be used in a chain stage")
 except Exception as e:
 	sys.stderr.write('error: ' + str(e) + '\n')
 	sys.exit(1)
 
+# 入力ファイルが1個のみの場合の処理 (--jobs など) は、その名前を使う
+inputFileName = inputFileNames[0] if len(inputFileNames) > 0 else None
 if headerNum is None: headerNum = 0
 if timeCol is None: timeCol = 1
 if valueCol is None: valueCol = 2
-if span is None : span = "day"
+if len(spans) == 0 : spans = ["day"]
 if weekStart is None : weekStart = "sun"
 if inputDate is None : inputDate = "%Y/%m/%d %H:%M:%S"
-if outputDate is None : outputDate = "%Y/%m/%d" if span in ["month", "week", "day"] else "%Y/%m/%d %H:%M:%S"
+outputDates = [outputDate if outputDate is not None else "%Y/%m/%d" if span in ["month", "week", "day"] else "%Y/%m/%d %H:%M:%S" for span in spans]
+if len(outputFileNames) == 0 : outputFileNames = [None]
+if jobs is None : jobs = 1
+if indexInterval is None : indexInterval = time_index.defaultInterval
+
+# 値は、--decimals の指定があれば固定小数点数 (10 ** decimals 倍した整数) として扱い、出力時に小数に戻す
+toValue = value_parser.toValue
+fixedPoint = None
+formatValue = None
+if decimals is not None:
+	fixedPoint = value_parser.FixedPoint(decimals)
+	toValue = fixedPoint.toValue
+	formatValue = fixedPoint.format
+
+stats = None
+if statsEnabled:
+	stats = run_stats.Stats("candle.py")
+	if statsSample is not None:
+		try:
+			stats.startSampling(statsSample)
+		except Exception as e:
+			sys.stderr.write('error: ' + str(e) + '\n')
+			sys.exit(1)
 
 weekStartNo = None
 weekNames = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
@@ -194,98 +407,894 @@ for i in range(len(weekNames)):
 	if weekStart == weekNames[i]:
 		weekStartNo = i
 
-intervalSeconds = None
+# 時刻は 0001/01/01 00:00:00 を 86400 (序数 1 の日の 0 時) とする整数の秒数で扱う
+secondsPerDay = 24 * 60 * 60
+
+def parseDateSlow(dateStr):
+	date = datetime.datetime.strptime(dateStr, inputDate)
+	return date.toordinal() * secondsPerDay + date.hour * 3600 + date.minute * 60 + date.second
+
+fastDateWidths = {"Y": 4, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2}
+fastTimeUnits = {"H": (3600, 23), "M": (60, 59), "S": (1, 59)}
+
+def compileDateParser(format):
+	# 固定幅の数字とそれ以外の文字のみからなる形式は、文字列の切り出しで解析する
+	# それ以外の形式や、固定幅の解析に合わない入力は strptime で解析する
+	fields = {}
+	literals = []
+	pos = 0
+	j = 0
+	while j < len(format):
+		if format[j] == "%":
+			if j + 1 >= len(format):
+				return parseDateSlow
+			directive = format[j + 1]
+			if directive == "%":
+				literals.append((pos, "%"))
+				pos += 1
+			elif directive in fastDateWidths and directive not in fields:
+				fields[directive] = (pos, pos + fastDateWidths[directive])
+				pos += fastDateWidths[directive]
+			else:
+				return parseDateSlow
+			j += 2
+		else:
+			literals.append((pos, format[j]))
+			pos += 1
+			j += 1
+	if "Y" not in fields or "m" not in fields or "d" not in fields:
+		return parseDateSlow
+
+	length = pos
+	yearBegin, yearEnd = fields["Y"]
+	monthBegin, monthEnd = fields["m"]
+	dayBegin, dayEnd = fields["d"]
+	dateBegin = min(yearBegin, monthBegin, dayBegin)
+	dateEnd = max(yearEnd, monthEnd, dayEnd)
+	dateLiterals = [x for x in literals if dateBegin <= x[0] < dateEnd]
+	otherLiterals = [x for x in literals if not (dateBegin <= x[0] < dateEnd)]
+	timeFields = [fields[x] + fastTimeUnits[x] for x in ["H", "M", "S"] if x in fields]
+	dayCache = {}
+
+	def parseDate(dateStr):
+		if len(dateStr) != length:
+			return parseDateSlow(dateStr)
+		for p, c in otherLiterals:
+			if dateStr[p] != c:
+				return parseDateSlow(dateStr)
+		datePart = dateStr[dateBegin:dateEnd]
+		t = dayCache.get(datePart)
+		if t is None:
+			for p, c in dateLiterals:
+				if dateStr[p] != c:
+					return parseDateSlow(dateStr)
+			year = dateStr[yearBegin:yearEnd]
+			month = dateStr[monthBegin:monthEnd]
+			day = dateStr[dayBegin:dayEnd]
+			if not (year.isdecimal() and month.isdecimal() and day.isdecimal()):
+				return parseDateSlow(dateStr)
+			try:
+				t = datetime.date(int(year), int(month), int(day)).toordinal() * secondsPerDay
+			except ValueError:
+				return parseDateSlow(dateStr)
+			if len(dayCache) >= 4096:
+				dayCache.clear()
+			dayCache[datePart] = t
+		for begin, end, unit, limit in timeFields:
+			v = dateStr[begin:end]
+			if not v.isdecimal():
+				return parseDateSlow(dateStr)
+			v = int(v)
+			if v > limit:
+				return parseDateSlow(dateStr)
+			t += v * unit
+		return t
+
+	return parseDate
 
-def getMonthKey(date):
-	return datetime.datetime(date.year, date.month, 1)
+parseDate = compileDateParser(inputDate)
 
-def getWeekKey(date):
-	day = datetime.datetime(date.year, date.month, date.day)
-	delta = (day.weekday() - weekStartNo + 7) % 7
-	return day - datetime.timedelta(days=delta)
+try:
+	fromTime = parseDate(fromDate) if fromDate is not None else None
+	toTime = parseDate(toDate) if toDate is not None else None
+except ValueError as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
 
-def getDayKey(date):
-	return datetime.datetime(date.year, date.month, date.day)
+def formatKey(key, outputDate):
+	date = datetime.datetime.fromordinal(key // secondsPerDay) + datetime.timedelta(seconds=key % secondsPerDay)
+	return date.strftime(outputDate)
 
-def getSecondKey(date):
-	day = datetime.datetime(date.year, date.month, date.day)
-	delta = date - day
-	seconds = (delta.seconds // intervalSeconds) * intervalSeconds
-	return day + datetime.timedelta(seconds=seconds)
+monthKeys = {}
 
-getKey = None
+def getMonthKey(t):
+	day = t // secondsPerDay
+	key = monthKeys.get(day)
+	if key is None:
+		date = datetime.date.fromordinal(day)
+		key = datetime.date(date.year, date.month, 1).toordinal() * secondsPerDay
+		monthKeys[day] = key
+	return key
 
-if span == "month":
-	getKey = getMonthKey
-elif span == "week":
-	if weekStartNo is None:
-		sys.stderr.write("error: invalid week start\n")
+def getWeekKey(t):
+	day = t // secondsPerDay
+	# 序数 1 の日は月曜日
+	delta = (day + 6 - weekStartNo) % 7
+	return (day - delta) * secondsPerDay
+
+def getDayKey(t):
+	return t - t % secondsPerDay
+
+def makeSecondKey(intervalSeconds):
+	def getSecondKey(t):
+		return t - t % intervalSeconds
+	return getSecondKey
+
+def parseSpan(span):
+	# 足の区切りを求める関数と、他の間隔の足から作れるかの判定に使う組を返す
+	if span == "month":
+		return getMonthKey, ("month",)
+	elif span == "week":
+		if weekStartNo is None:
+			raise Exception("invalid week start")
+		return getWeekKey, ("week",)
+	elif span == "day":
+		return getDayKey, ("second", secondsPerDay)
+	elif len(span) > 0 and span[-1] in ["h", "m", "s"]:
+		try:
+			intervalSeconds = int(span[:-1])
+		except ValueError:
+			raise Exception("invalid span")
+		if intervalSeconds <= 0:
+			raise Exception("span must be positive")
+		if span[-1] == "h":
+			intervalSeconds *= 60 * 60
+		elif span[-1] == "m":
+			intervalSeconds *= 60
+		if secondsPerDay % intervalSeconds != 0:
+			raise Exception("no remainder allowed for sub-day span")
+		return makeSecondKey(intervalSeconds), ("second", intervalSeconds)
+	raise Exception("invalid span")
+
+def spanSize(unit):
+	if unit[0] == "month":
+		return 31 * secondsPerDay
+	elif unit[0] == "week":
+		return 7 * secondsPerDay
+	return unit[1]
+
+def canRollUp(fine, coarse):
+	# 1日を割り切る間隔の足は日をまたがないため、日・週・月の足にまとめられる
+	if fine[0] == "second":
+		return coarse[0] != "second" or coarse[1] % fine[1] == 0
+	return fine == coarse
+
+def parseDuration(duration):
+	units = {"h": 60 * 60, "m": 60, "s": 1}
+	if len(duration) == 0 or duration[-1] not in units:
+		raise Exception("invalid duration")
+	try:
+		seconds = int(duration[:-1])
+	except ValueError:
+		raise Exception("invalid duration")
+	if seconds < 0:
+		raise Exception("duration must be non-negative")
+	return seconds * units[duration[-1]]
+
+try:
+	spanKeys = [parseSpan(span) for span in spans]
+	if maxLateness is not None:
+		maxLateness = parseDuration(maxLateness)
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+# 最も細かい間隔の足を入力から作り、他の間隔の足はそれより細かい間隔の足から作る
+spanOrder = sorted(range(len(spans)), key=lambda k: spanSize(spanKeys[k][1]))
+spanSources = [None] * len(spans)
+for n in range(1, len(spanOrder)):
+	k = spanOrder[n]
+	for source in reversed(spanOrder[:n]):
+		if canRollUp(spanKeys[source][1], spanKeys[k][1]):
+			spanSources[k] = source
+			break
+	if spanSources[k] is None:
+		sys.stderr.write("error: span {0} cannot be built from span {1}\n".format(spans[k], spans[spanOrder[0]]))
 		sys.exit(1)
-	getKey = getWeekKey
-elif span == "day":
-	getKey = getDayKey
-elif span[-1] in ["h", "m", "s"]:
+getKey = spanKeys[spanOrder[0]][0]
+
+def mergeCandle(pending, candle):
+	# 同じ区切りの足をまとめる (高値・安値が等しい場合は先の値を残す)
+	return (pending[0], pending[1],
+		candle[2] if candle[2] > pending[2] else pending[2],
+		candle[3] if candle[3] < pending[3] else pending[3],
+		candle[4])
+
+class Rollup:
+	# 細かい間隔の足を受け取り、粗い間隔の足にまとめる
+	__slots__ = ("getKey", "writeCandle", "pending")
+
+	def __init__(self, getKey, writeCandle, pending):
+		self.getKey = getKey
+		self.writeCandle = writeCandle
+		self.pending = pending
+
+	def add(self, key, beginning, high, low, close):
+		candle = (self.getKey(key), beginning, high, low, close)
+		pending = self.pending
+		if pending is None:
+			self.pending = candle
+		elif pending[0] < candle[0]:
+			self.writeCandle(*pending)
+			self.pending = candle
+		elif pending[0] == candle[0]:
+			self.pending = mergeCandle(pending, candle)
+		else:
+			raise Exception("date must be ascending order")
+
+def connectOutputs(csvWriters, pendings):
+	# 各間隔の足の出力先をつなぎ、最も細かい間隔の足を書き出す関数と、各間隔の Rollup を返す
+	rollups = [None] * len(spans)
+	writeCandles = [None] * len(spans)
+	for k in reversed(spanOrder):
+		children = [rollups[c] for c in range(len(spans)) if spanSources[c] == k]
+		def writeCandle(key, beginning, high, low, close, csvWriter=csvWriters[k], outputDate=outputDates[k], children=children):
+			if formatValue is None:
+				csvWriter.writerow([formatKey(key, outputDate), beginning, high, low, close])
+			else:
+				csvWriter.writerow([formatKey(key, outputDate), formatValue(beginning), formatValue(high), formatValue(low), formatValue(close)])
+			for child in children:
+				child.add(key, beginning, high, low, close)
+		writeCandles[k] = writeCandle
+		if spanSources[k] is not None:
+			rollups[k] = Rollup(spanKeys[k][0], writeCandle, pendings[k])
+	return writeCandles[spanOrder[0]], rollups
+
+def finishOutputs(candle, writeCandle, rollups):
+	# 未確定の足を細かい間隔から順に書き出す
+	if candle is not None:
+		writeCandle(*candle)
+	for k in spanOrder:
+		if rollups[k] is not None and rollups[k].pending is not None:
+			rollups[k].writeCandle(*rollups[k].pending)
+			rollups[k].pending = None
+
+# 入力からは時刻・値 (・銘柄) の列のみを取り出す
+tickColumns = [timeCol - 1, valueCol - 1] + ([groupCol - 1] if groupCol is not None else [])
+
+def parseTicks(rows):
+	for timeStr, valueStr in rows:
+		yield parseDate(timeStr), toValue(valueStr)
+
+def limitTicks(ticks):
+	# --from / --to の範囲の入力のみを返す (入力は昇順のため、範囲を過ぎたら読むのをやめる)
+	for tick in ticks:
+		if fromTime is not None and tick[0] < fromTime:
+			continue
+		if toTime is not None and tick[0] >= toTime:
+			break
+		yield tick
+
+def parseRecordTime(lines):
+	# 1行分のバイト列のリストから時刻を解析する (索引の作成と検索に使う)
+	raw = column_reader.rawEncoding(inputEncode)
+	if raw is None:
+		lines = [x.decode(inputEncode if inputEncode is not None else locale.getpreferredencoding(False)) for x in lines]
+	return parseDate(next(column_reader.projectLines(lines, [timeCol - 1], raw))[0])
+
+def findRangeStart(f, fileName):
+	# ヘッダ行の後から、--from の日時の入力を含む範囲の開始位置を探す
+	begin = skipRecords(f, headerNum)
+	entries = time_index.loadIndex(fileName, time_index.indexKey(fileName, inputEncode, headerNum, timeCol - 1, inputDate))
+	if entries is not None:
+		return time_index.findIndexedStart(entries, begin, fromTime)
+	return time_index.findStart(f, begin, os.fstat(f.fileno()).st_size, fromTime, lambda line: parseRecordTime([line]))
+
+def recordTicks(ticks, timeWriter, valueWriter):
+	for t, value in ticks:
+		timeWriter.append(t)
+		valueWriter.append(value)
+		yield t, value
+
+# 銘柄ごとの集計では、銘柄を現れた順の番号で表し、足の各値を番号で引く配列に持つ
+symbolIds = {}
+symbolNames = []
+
+def parseGroupTicks(rows):
+	for timeStr, valueStr, symbol in rows:
+		symbolId = symbolIds.get(symbol)
+		if symbolId is None:
+			symbolId = len(symbolNames)
+			symbolIds[symbol] = symbolId
+			symbolNames.append(symbol)
+		yield parseDate(timeStr), symbolId, toValue(valueStr)
+
+def parseGroupRows(rows):
+	for timeStr, valueStr, symbol in rows:
+		yield parseDate(timeStr), symbol, toValue(valueStr)
+
+def numberSymbols(ticks):
+	# 入力が複数の場合は、銘柄が現れた順がマージした後で決まるため、マージした後で番号を付ける
+	for t, symbol, value in ticks:
+		symbolId = symbolIds.get(symbol)
+		if symbolId is None:
+			symbolId = len(symbolNames)
+			symbolIds[symbol] = symbolId
+			symbolNames.append(symbol)
+		yield t, symbolId, value
+
+def readTicks(inputStreams, parse):
+	# 入力が複数の場合は、それぞれを解析した結果を時刻の順にマージする (同じ時刻は入力を指定した順)
+	if len(inputStreams) == 1:
+		return parse(inputStreams[0])
+	streams = [parse(x) for x in inputStreams]
+	if pipelined:
+		streams = [pipeline.iterateAhead(x) for x in streams]
+	return heapq.merge(*streams, key=operator.itemgetter(0))
+
+class GroupCandles:
+	# 銘柄ごとの足を作り、全体の時刻が次の区切りに進んだときに、その区切りの全銘柄の足を書き出す
+	__slots__ = ("getKey", "writeCandle", "key", "active", "opens", "highs", "lows", "closes")
+
+	def __init__(self, getKey, writeCandle):
+		self.getKey = getKey
+		self.writeCandle = writeCandle
+		self.key = None
+		self.active = []
+		self.opens = []
+		self.highs = []
+		self.lows = []
+		self.closes = []
+
+	def add(self, key, symbolId, beginning, high, low, close):
+		key = self.getKey(key)
+		if self.key is None or self.key < key:
+			self.flush()
+			self.key = key
+		elif self.key > key:
+			raise Exception("date must be ascending order")
+		if symbolId >= len(self.opens):
+			grow = [None] * (symbolId + 1 - len(self.opens))
+			self.opens.extend(grow)
+			self.highs.extend(grow)
+			self.lows.extend(grow)
+			self.closes.extend(grow)
+		if self.opens[symbolId] is None:
+			self.active.append(symbolId)
+			self.opens[symbolId] = beginning
+			self.highs[symbolId] = high
+			self.lows[symbolId] = low
+		else:
+			if high > self.highs[symbolId]: self.highs[symbolId] = high
+			if low < self.lows[symbolId]: self.lows[symbolId] = low
+		self.closes[symbolId] = close
+
+	def flush(self):
+		if len(self.active) == 0:
+			return
+		self.active.sort()
+		for symbolId in self.active:
+			self.writeCandle(self.key, symbolId, self.opens[symbolId], self.highs[symbolId], self.lows[symbolId], self.closes[symbolId])
+			self.opens[symbolId] = None
+		self.active = []
+
+def connectGroupOutputs(csvWriters):
+	# 各間隔の GroupCandles を、細かい間隔の足が粗い間隔の GroupCandles に渡るようにつなぎ、細かい順に返す
+	groups = [None] * len(spans)
+	for k in reversed(spanOrder):
+		children = [groups[c] for c in range(len(spans)) if spanSources[c] == k]
+		def writeCandle(key, symbolId, beginning, high, low, close, csvWriter=csvWriters[k], outputDate=outputDates[k], children=children):
+			if formatValue is None:
+				csvWriter.writerow([formatKey(key, outputDate), symbolNames[symbolId], beginning, high, low, close])
+			else:
+				csvWriter.writerow([formatKey(key, outputDate), symbolNames[symbolId], formatValue(beginning), formatValue(high), formatValue(low), formatValue(close)])
+			for child in children:
+				child.add(key, symbolId, beginning, high, low, close)
+		groups[k] = GroupCandles(spanKeys[k][0], writeCandle)
+	return [groups[k] for k in spanOrder]
+
+def aggregateGroups(ticks, groups):
+	add = groups[0].add
+	for t, symbolId, value in ticks:
+		add(t, symbolId, value, value, value, value)
+	for group in groups:
+		group.flush()
+
+def aggregateCandles(ticks, writeCandle, candle=None):
+	# (時刻, 値) の組を順に集計し、確定した足は writeCandle に渡し、最後の未確定の足を返す
+	if candle is None:
+		prevKey = None
+
+		beginning = None
+		high = None
+		low = None
+		prevValue = None
+	else:
+		prevKey, beginning, high, low, prevValue = candle
+
+	for t, value in ticks:
+		key = getKey(t)
+		if prevKey is None or prevKey < key:
+			if prevKey is not None:
+				writeCandle(prevKey, beginning, high, low, prevValue)
+			prevKey = key
+			beginning = value
+			high = value
+			low = value
+		elif prevKey == key:
+			if value > high: high = value
+			if value < low: low = value
+		else:
+			raise Exception("date must be ascending order")
+		prevValue = value
+
+	if prevKey is None:
+		return None
+	return (prevKey, beginning, high, low, prevValue)
+
+def aggregateLateCandles(ticks, writeCandle):
+	# 最も新しい時刻から maxLateness 秒前 (ウォーターマーク) の足より前の足を確定させ、時刻の順に書き出す
+	# 未確定の足は [始値の時刻, 始値, 高値, 安値, 終値の時刻, 終値] として区切りごとに持つ
+	# 確定した足に入る入力は数えて捨て、その数を返す
+	openCandles = {}
+	openKeys = []
+	latestTime = None
+	watermarkKey = None
+	lateCount = 0
+
+	for t, value in ticks:
+		if latestTime is None or t > latestTime:
+			latestTime = t
+			watermarkKey = getKey(t - maxLateness)
+			while len(openKeys) > 0 and openKeys[0] < watermarkKey:
+				key = heapq.heappop(openKeys)
+				c = openCandles.pop(key)
+				writeCandle(key, c[1], c[2], c[3], c[5])
+		key = getKey(t)
+		if key < watermarkKey:
+			lateCount += 1
+			continue
+		c = openCandles.get(key)
+		if c is None:
+			openCandles[key] = [t, value, value, value, t, value]
+			heapq.heappush(openKeys, key)
+		else:
+			if t < c[0]:
+				c[0] = t
+				c[1] = value
+			if value > c[2]: c[2] = value
+			if value < c[3]: c[3] = value
+			if t >= c[4]:
+				c[4] = t
+				c[5] = value
+
+	while len(openKeys) > 0:
+		key = heapq.heappop(openKeys)
+		c = openCandles.pop(key)
+		writeCandle(key, c[1], c[2], c[3], c[5])
+	return lateCount
+
+# 並列処理用に、入力ファイルを行の区切りでバイト単位の範囲に分割する
+# 行の区切りは、column_reader.recordEnds で " で囲まれた列の外にある改行の直後とする
+blockSize = 1024 * 1024
+
+def skipRecords(f, count):
+	# 現在位置から count 個の行を読み飛ばした位置を返す (行が足りない場合はファイルの末尾)
+	pos = f.tell()
+	if count > 0:
+		for pos in column_reader.recordEnds(f):
+			count -= 1
+			if count == 0:
+				break
+		else:
+			pos = f.seek(0, os.SEEK_END)
+	f.seek(pos)
+	return pos
+
+def findRecordStarts(f, begin, end, positions):
+	# begin (行の先頭) から end までを読み、昇順に並んだ positions の各位置以降で最初の行の区切りを返す
+	f.seek(begin)
+	starts = []
+	for pos in column_reader.recordEnds(f, end):
+		while len(starts) < len(positions) and positions[len(starts)] <= pos:
+			starts.append(pos)
+		if len(starts) == len(positions):
+			break
+	return starts + [end] * (len(positions) - len(starts))
+
+def readLines(begin, end):
+	# バイト列のまま列を取り出せる文字コードの場合は、文字列に変換せずに返す
+	if column_reader.rawEncoding(inputEncode) is not None:
+		with open(inputFileName, 'rb') as f:
+			f.seek(begin)
+			while begin < end:
+				line = f.readline()
+				if len(line) == 0:
+					break
+				begin += len(line)
+				yield line
+		return
+	decoder = codecs.getincrementaldecoder(inputEncode if inputEncode is not None else locale.getpreferredencoding(False))()
+	with open(inputFileName, 'rb') as f:
+		f.seek(begin)
+		while begin < end:
+			line = f.readline()
+			if len(line) == 0:
+				break
+			begin += len(line)
+			yield decoder.decode(line)
+	rest = decoder.decode(b'', True)
+	if len(rest) > 0:
+		yield rest
+
+def readRecords(begin, end):
+	records = column_reader.projectLines(readLines(begin, end), tickColumns, column_reader.rawEncoding(inputEncode))
+	return records if stats is None else stats.timeIterator("read", records)
+
+def findLastRecordEnd(f, begin, end):
+	# begin (行の先頭) 以降 end までで最後の行の区切りを返す (末尾の改行で終わっていない行は含まない)
+	f.seek(begin)
+	last = begin
+	for last in column_reader.recordEnds(f, end):
+		pass
+	return last
+
+def aggregateRange(fileRange):
+	candles = []
+	candle = aggregateCandles(parseTicks(readRecords(fileRange[0], fileRange[1])), lambda *candle: candles.append(candle))
+	if candle is not None:
+		candles.append(candle)
+	return candles
+
+def aggregateParallel(f, dataBegin, dataEnd, pending, writeCandle):
+	# 各プロセスに偏りなく仕事が割り振られるよう、プロセス数より細かく分割する
+	chunkCount = min(jobs * 4, max(1, (dataEnd - dataBegin) // blockSize))
+	splits = [dataBegin + (dataEnd - dataBegin) * k // chunkCount for k in range(chunkCount + 1)]
+	starts = [dataBegin] + findRecordStarts(f, dataBegin, dataEnd, splits[1:chunkCount]) + [dataEnd]
+	with multiprocessing.get_context('fork').Pool(jobs) as pool:
+		ranges = [(starts[k], starts[k + 1]) for k in range(chunkCount) if starts[k] < starts[k + 1]]
+		# 範囲の境界をまたぐ足は、始値・高値・安値・終値をそれぞれまとめる
+		for candles in pool.imap(aggregateRange, ranges):
+			for candle in candles:
+				if pending is None:
+					pending = candle
+				elif pending[0] < candle[0]:
+					writeCandle(*pending)
+					pending = candle
+				elif pending[0] == candle[0]:
+					pending = mergeCandle(pending, candle)
+				else:
+					raise Exception("date must be ascending order")
+	return pending
+
+def aggregateFileRange(f, begin, end, candle, writeCandle):
+	if jobs > 1:
+		return aggregateParallel(f, begin, end, candle, writeCandle)
+	return aggregateCandles(parseTicks(readRecords(begin, end)), writeCandle, candle)
+
+# 途中から再開するための状態は、入力・出力のどこまでを処理したかと未確定の足を保存する
+# 集計方法に関わる設定が変わった場合は、状態を引き継がない
+stateOptions = {
+	"headerNum": headerNum,
+	"timeCol": timeCol,
+	"valueCol": valueCol,
+	"spans": spans,
+	"weekStart": weekStart,
+	"inputDate": inputDate,
+	"outputDates": outputDates,
+	"inputEncode": inputEncode,
+	"outputEncode": outputEncode,
+}
+if decimals is not None:
+	stateOptions["decimals"] = decimals
+
+def inputSignature(f, length):
+	f.seek(0)
+	return hashlib.sha1(f.read(min(length, 4096))).hexdigest()
+
+def loadState():
 	try:
-		intervalSeconds = int(span[:-1])
+		with open(stateFileName, 'r') as f:
+			state = json.load(f)
+	except FileNotFoundError:
+		return None
 	except ValueError:
-		sys.stderr.write("error: invalid span\n")
+		raise Exception("broken state file " + stateFileName)
+	if state.get("options") != stateOptions:
+		raise Exception("state file " + stateFileName + " was saved with different options")
+	return state
+
+def saveState(state):
+	tempFileName = stateFileName + ".tmp"
+	with open(tempFileName, 'w') as f:
+		json.dump(state, f)
+	os.replace(tempFileName, stateFileName)
+
+def aggregateIncremental():
+	state = loadState()
+	outputFiles = []
+	try:
+		with open(inputFileName, 'rb') as f:
+			inputSize = os.fstat(f.fileno()).st_size
+			if state is None:
+				begin = skipRecords(f, headerNum)
+				for outputFileName in outputFileNames:
+					outputFiles.append(open(outputFileName, 'w', newline='', encoding=outputEncode))
+					csv.writer(outputFiles[-1]).writerow(["date", "open", "high", "low", "close"])
+				candles = [None] * len(spans)
+			else:
+				begin = state["inputOffset"]
+				if inputSize < begin or inputSignature(f, begin) != state["inputSignature"]:
+					raise Exception("input file was replaced or truncated since the state was saved")
+				for k in range(len(spans)):
+					try:
+						outputFiles.append(open(outputFileNames[k], 'r+', newline='', encoding=outputEncode))
+					except FileNotFoundError:
+						raise Exception("output file " + outputFileNames[k] + " for the state does not exist")
+					# 前回出力した未確定の足を書き直す
+					outputFiles[-1].seek(state["outputs"][k]["outputOffset"])
+					outputFiles[-1].truncate()
+				candles = [tuple(x["candle"]) if x["candle"] is not None else None for x in state["outputs"]]
+			end = findLastRecordEnd(f, begin, inputSize)
+			csvWriters = [csv.writer(x) for x in outputFiles]
+			if stats is not None:
+				csvWriters = [stats.timeWriter("write", x) for x in csvWriters]
+			writeCandle, rollups = connectOutputs(csvWriters, candles)
+			candle = aggregateFileRange(f, begin, end, candles[spanOrder[0]], writeCandle)
+			outputs = []
+			for k in range(len(spans)):
+				outputs.append({
+					"outputOffset": outputFiles[k].tell(),
+					"candle": candle if rollups[k] is None else rollups[k].pending,
+				})
+			finishOutputs(candle, writeCandle, rollups)
+			reportStats(end - begin, outputFiles)
+			saveState({
+				"options": stateOptions,
+				"inputOffset": end,
+				"inputSignature": inputSignature(f, end),
+				"outputs": outputs,
+			})
+	finally:
+		for outputFile in outputFiles:
+			outputFile.close()
+
+def reportStats(bytesRead, outputFiles):
+	if stats is None:
+		return
+	# --jobs 指定時に子プロセスで読み込んだ行は数えられない
+	if jobs == 1 or stats.stage("read")[1] > 0:
+		stats.rowsRead = stats.stage("read")[1]
+	stats.rowsWritten = stats.stage("write")[1]
+	stats.bytesRead = bytesRead
+	bytesWritten = [run_stats.streamPosition(x) for x in outputFiles]
+	stats.bytesWritten = sum(bytesWritten) if len(bytesWritten) > 0 and None not in bytesWritten else None
+	stats.report(statsFileName)
+
+if stage is not None and stage.input is not None:
+	if fixedPoint is None:
+		toValue = stage_io.typedParser(toValue)
+	else:
+		# 前の段から受け取った数値も、CSV に書き出した場合と同じ文字列にして桁数を確認する
+		def parseFixed(v, parse=toValue):
+			return parse(v if type(v) is str else str(v))
+		toValue = parseFixed
+
+if stats is not None:
+	parseDate = stats.timeFunction("parseDate", parseDate)
+	parseDateSlow = stats.countCalls("dates parsed with strptime", parseDateSlow)
+	toValue = stats.timeFunction("toValue", toValue)
+	getKey = stats.timeFunction("key", getKey)
+	formatKey = stats.timeFunction("formatDate", formatKey)
+
+if jobs > 1:
+	if inputFileName is None:
+		sys.stderr.write("error: --jobs requires -i or --input-file\n")
+		sys.exit(1)
+	if 'fork' not in multiprocessing.get_all_start_methods():
+		sys.stderr.write("error: --jobs is not supported on this platform\n")
+		sys.exit(1)
+
+if useCache:
+	if inputFileName is None:
+		sys.stderr.write("error: --cache requires -i or --input-file\n")
+		sys.exit(1)
+	if stateFileName is not None:
+		sys.stderr.write("error: --cache cannot be used with --state\n")
 		sys.exit(1)
-	if intervalSeconds <= 0:
-		sys.stderr.write("error: span must be positive\n")
+
+if maxLateness is not None:
+	if groupCol is not None or jobs > 1 or stateFileName is not None:
+		sys.stderr.write("error: --max-lateness cannot be used with --group, --jobs or --state\n")
+		sys.exit(1)
+
+if groupCol is not None:
+	if jobs > 1 or stateFileName is not None or useCache:
+		sys.stderr.write("error: --group cannot be used with --jobs, --state or --cache\n")
 		sys.exit(1)
-	if span[-1] == "h":
-		intervalSeconds *= 60 * 60
-	elif span[-1] == "m":
-		intervalSeconds * 60
-	if (24 * 60 * 60) % intervalSeconds != 0:
-		sys.stderr.write("error: no remainder allowed for sub-day span\n")
+
+if buildIndex:
+	if inputFileName is None:
+		sys.stderr.write("error: --build-index requires -i or --input-file\n")
+		sys.exit(1)
+	try:
+		if compressed_io.inputCompression(inputFileName) is not None:
+			raise Exception("--build-index cannot be used with compressed input")
+		with open(inputFileName, 'rb') as f:
+			begin = skipRecords(f, headerNum)
+		time_index.buildIndex(inputFileName, time_index.indexKey(inputFileName, inputEncode, headerNum, timeCol - 1, inputDate), begin, parseRecordTime, indexInterval)
+	except Exception as e:
+		sys.stderr.write('error: ' + str(e) + '\n')
 		sys.exit(1)
-	getKey = getSecondKey
-
-inputFile = open(inputFileName, 'r', newline='') if inputFileName is not None else sys.stdin
-outputFile = open(outputFileName, 'w', newline='') if outputFileName is not None else sys.stdout
-if outputFileName is None:
-	sys.stdout.reconfigure(newline='')
-
-inputFileReader = codecs.getreader(inputEncode)(inputFile) if inputEncode is not None else inputFile
-outputFileWriter = codecs.getwriter(outputEncode)(outputFile) if outputEncode is not None else outputFile
-
-csvReader = csv.reader(inputFileReader)
-csvWriter = csv.writer(outputFileWriter)
-
-prevKey = None
-
-beginning = None
-high = None
-low = None
-prevValue = None
-
-csvWriter.writerow(["date", "open", "high", "low", "close"])
-
-lineNo = 0
-for row in csvReader:
-	lineNo += 1
-	if lineNo <= headerNum:
-		continue
-	key = getKey(datetime.datetime.strptime(row[timeCol - 1], inputDate))
-	value = toValue(row[valueCol - 1])
-	if prevKey is None or prevKey < key:
-		if prevKey is not None:
-			csvWriter.writerow([prevKey.strftime(outputDate), beginning, high, low, prevValue])
-		prevKey = key
-		beginning = value
-		high = value
-		low = value
-	elif prevKey == key:
-		if value > high: high = value
-		if value < low: low = value
+	sys.exit(0)
+
+if fromTime is not None or toTime is not None:
+	if jobs > 1 or stateFileName is not None or useCache or maxLateness is not None:
+		sys.stderr.write("error: --from and --to cannot be used with --jobs, --state, --cache or --max-lateness\n")
+		sys.exit(1)
+
+if pipelined and (jobs > 1 or stateFileName is not None):
+	sys.stderr.write("error: --pipelined cannot be used with --jobs or --state\n")
+	sys.exit(1)
+
+if jobs > 1 or stateFileName is not None:
+	if inputFileName is not None and compressed_io.inputCompression(inputFileName) is not None:
+		sys.stderr.write("error: compressed input cannot be used with --jobs or --state\n")
+		sys.exit(1)
+	if stateFileName is not None and any(x is not None and compressed_io.outputCompression(x) is not None for x in outputFileNames):
+		sys.stderr.write("error: compressed output cannot be used with --state\n")
+		sys.exit(1)
+
+if stateFileName is not None:
+	if inputFileName is None or None in outputFileNames:
+		sys.stderr.write("error: --state requires both input and output file names\n")
+		sys.exit(1)
+	try:
+		aggregateIncremental()
+	except Exception as e:
+		sys.stderr.write('error: ' + str(e) + '\n')
+		sys.exit(1)
+	sys.exit(0)
+
+inputFiles = []
+outputFiles = []
+if stage is None or stage.input is None:
+	inputFiles = [compressed_io.openInput(x) for x in inputFileNames] if len(inputFileNames) > 0 else [sys.stdin.buffer]
+inputFile = inputFiles[0] if len(inputFiles) > 0 else None
+if stage is None or stage.output is None:
+	outputFiles = [compressed_io.openTextOutput(outputFileName, outputEncode, compressLevel) if outputFileName is not None else sys.stdout for outputFileName in outputFileNames]
+	if None in outputFileNames:
+		sys.stdout.reconfigure(newline='', encoding=outputEncode)
+
+def openRecords(f, fileName):
+	# 入力から時刻・値 (・銘柄) の列を取り出し、ヘッダ行を除いた行を返す
+	# --from の指定があり、入力ファイルを読む位置を変えられる場合は、範囲の開始位置から読む
+	recordsToSkip = headerNum
+	if fromTime is not None and fileName is not None and f.seekable():
+		f.seek(findRangeStart(f, fileName))
+		recordsToSkip = 0
+	lines, lineEncoding = column_reader.openLines(f, inputEncode if inputEncode is not None or fileName is not None else sys.stdin.encoding)
+	# 入力ファイルが複数の場合は、解析までをまとめて別のスレッドで行う (readTicks)
+	if pipelined and len(inputFiles) == 1:
+		lines = pipeline.readAhead(lines)
+	lines = column_reader.skipLines(lines, recordsToSkip, lineEncoding)
+	records = column_reader.projectLines(lines, tickColumns, lineEncoding)
+	if stats is not None:
+		records = stats.timeIterator("read", records)
+	return records
+
+def inputBytesRead():
+	positions = [run_stats.streamPosition(x) for x in inputFiles]
+	return sum(positions) if len(positions) > 0 and None not in positions else None
+
+try:
+	if stage is not None and stage.input is not None:
+		records = column_reader.projectRows(itertools.islice(stage.input.rows(), headerNum, None), tickColumns)
+		if stats is not None:
+			records = stats.timeIterator("read", records)
+		inputStreams = [records]
 	else:
-		sys.stderr.write("error: date must be ascending order")
+		inputStreams = [openRecords(f, x) for f, x in zip(inputFiles, inputFileNames if len(inputFileNames) > 0 else [None])]
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+csvWriters = [csv.writer(outputFile) for outputFile in outputFiles] if stage is None or stage.output is None else [stage.output]
+pipelineWriters = []
+if pipelined:
+	pipelineWriters = [pipeline.PipelinedWriter(x.writerows) for x in csvWriters]
+	csvWriters = pipelineWriters
+if stats is not None:
+	csvWriters = [stats.timeWriter("write", x) for x in csvWriters]
+
+if groupCol is not None:
+	for csvWriter in csvWriters:
+		csvWriter.writerow(["date", "symbol", "open", "high", "low", "close"])
+	try:
+		if len(inputStreams) == 1:
+			ticks = parseGroupTicks(inputStreams[0])
+		else:
+			ticks = numberSymbols(readTicks(inputStreams, parseGroupRows))
+		if fromTime is not None or toTime is not None:
+			ticks = limitTicks(ticks)
+		aggregateGroups(ticks, connectGroupOutputs(csvWriters))
+	except Exception as e:
+		for outputFile in outputFiles:
+			outputFile.flush()
+		sys.stderr.write('error: ' + str(e) + '\n')
 		sys.exit(1)
-	prevValue = value
+	for pipelineWriter in pipelineWriters:
+		pipelineWriter.close()
+	reportStats(inputBytesRead(), outputFiles)
+	for f in inputFiles:
+		f.close()
+	for outputFile in outputFiles:
+		outputFile.close()
+	sys.exit(0)
+
+for csvWriter in csvWriters:
+	csvWriter.writerow(["date", "open", "high", "low", "close"])
+
+writeCandle, rollups = connectOutputs(csvWriters, [None] * len(spans))
+
+cachedTicks = None
+cacheWriters = []
+if useCache:
+	timeKey = column_cache.columnKey(inputFileName, inputEncode, headerNum, timeCol - 1, "time", inputDate)
+	valueKey = column_cache.columnKey(inputFileName, inputEncode, headerNum, valueCol - 1, "value")
+	if decimals is not None:
+		valueKey["decimals"] = decimals
+	times = column_cache.openColumn(inputFileName, timeKey)
+	values = column_cache.openColumn(inputFileName, valueKey)
+	if times is not None and values is not None:
+		cachedTicks = zip(times, values)
+		if stats is not None:
+			cachedTicks = stats.timeIterator("read", cachedTicks)
+	elif jobs == 1:
+		cacheWriters = [column_cache.ColumnWriter(inputFileName, timeKey), column_cache.ColumnWriter(inputFileName, valueKey)]
+
+try:
+	if cachedTicks is None and jobs > 1:
+		with open(inputFileName, 'rb') as f:
+			candle = aggregateParallel(f, skipRecords(f, headerNum), os.fstat(f.fileno()).st_size, None, writeCandle)
+	else:
+		ticks = cachedTicks
+		if ticks is None:
+			ticks = readTicks(inputStreams, parseTicks)
+			if fromTime is not None or toTime is not None:
+				ticks = limitTicks(ticks)
+			if len(cacheWriters) > 0:
+				ticks = recordTicks(ticks, *cacheWriters)
+		if maxLateness is not None:
+			candle = None
+			lateCount = aggregateLateCandles(ticks, writeCandle)
+		else:
+			candle = aggregateCandles(ticks, writeCandle)
+	finishOutputs(candle, writeCandle, rollups)
+	for pipelineWriter in pipelineWriters:
+		pipelineWriter.close()
+except Exception as e:
+	for cacheWriter in cacheWriters:
+		cacheWriter.abort()
+	for outputFile in outputFiles:
+		outputFile.flush()
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+for cacheWriter in cacheWriters:
+	cacheWriter.commit()
+
+if maxLateness is not None:
+	sys.stderr.write('late ticks dropped: {0}\n'.format(lateCount))
+	if stats is not None:
+		stats.count("late ticks dropped", lateCount)
 
-if prevKey is not None:
-	csvWriter.writerow([key.strftime(outputDate), beginning, high, low, prevValue])
+if cachedTicks is None and jobs > 1:
+	reportStats(os.fstat(inputFile.fileno()).st_size, outputFiles)
+else:
+	reportStats(inputBytesRead(), outputFiles)
 
-inputFile.close()
-outputFile.close()
+for f in inputFiles:
+	f.close()
+for outputFile in outputFiles:
+	outputFile.close()
@@ -0,0 +1,94 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+usage = """
+Usage: ./chain.py <stage> [! <stage> ...]
+
+stage:
+  reverse [options]                : reverse.py と同じオプションで、行を逆順にする (または並べ替える)
+  ma [options]                     : copy_add_ma.py と同じオプションで、指定したデータを出力する
+  candle [options]                 : candle.py と同じオプションで、足を出力する
+
+例: ./chain.py reverse -i in.csv --header 1 ! ma --header 1 -c 1 -a 2 20 ! candle --header 1 -v 2 -s 5m -o out.csv
+
+各段は同じプロセスの中で並行して動かし、前の段が出力した行を、CSV の文字列に戻さずに
+解析済みの値のまま次の段の入力とする。
+CSV として読み込むのは最初の段のみ、CSV として書き出すのは最後の段のみである。
+
+入力ファイル名・入力文字コードは最初の段でのみ、
+出力ファイル名・出力文字コード・圧縮レベルは最後の段でのみ指定できる。
+各段では --pipelined・--stats-sample は指定できない。
+そのほか、段として動かす場合に使えないオプションは、各段でエラーとなる。
+""".strip()
+
+import sys
+import threading
+
+import stage_io
+
+if len(sys.argv) < 2 or sys.argv[1] == '-h' or sys.argv[1] == '--help':
+	print(usage)
+	sys.exit(0)
+
+stageArgs = [[]]
+for arg in sys.argv[1:]:
+	if arg == '!':
+		stageArgs.append([])
+	else:
+		stageArgs[-1].append(arg)
+
+try:
+	for args in stageArgs:
+		if len(args) == 0:
+			raise Exception("empty stage")
+		if args[0] not in stage_io.toolScripts:
+			raise Exception("unknown stage " + args[0])
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+channels = [stage_io.RowChannel() for k in range(len(stageArgs) - 1)]
+stages = []
+for k in range(len(stageArgs)):
+	script = stage_io.scriptPath(stageArgs[k][0])
+	stage = stage_io.Stage([script] + stageArgs[k][1:],
+		channels[k - 1] if k > 0 else None,
+		channels[k] if k < len(channels) else None)
+	stages.append((script, stage))
+
+# 最後の段はメインのスレッドで動かし、それ以外の段は別のスレッドで動かす
+exitCodes = [0] * len(stages)
+def runStage(k):
+	exitCodes[k] = stage_io.runScript(*stages[k])
+
+threads = [threading.Thread(target=runStage, args=(k,), daemon=True) for k in range(len(stages) - 1)]
+for thread in threads:
+	thread.start()
+runStage(len(stages) - 1)
+for thread in threads:
+	thread.join()
+
+sys.exit(next((x for x in exitCodes if x != 0), 0))
@@ -0,0 +1,199 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# 入力ファイルの列を解析した結果を、入力ファイルの隣のディレクトリに型付きの配列として保存する
+# 保存した結果は、入力ファイルのパス・サイズ・更新時刻と、解析の設定が一致する場合のみ使う
+#
+# 列の種類
+#   time  : 時刻 (整数の秒数) を 'q' の配列で保存する
+#   value : 数値を 'd' の配列、その型 (0: 数値でない, 1: 整数, 2: 浮動小数点数) を 'b' の配列で保存する
+#   text  : 文字列を UTF-8 で連結したものと、各行の開始位置の 'q' の配列で保存する
+
+import array
+import hashlib
+import json
+import mmap
+import os
+
+cacheSuffix = ".colcache"
+flushRows = 65536
+# 浮動小数点数として正確に保存できる整数の範囲
+exactIntLimit = 2 ** 53
+
+def cacheDirectory(inputFileName):
+	return os.path.abspath(inputFileName) + cacheSuffix
+
+def sourceInfo(inputFileName):
+	st = os.stat(inputFileName)
+	return {"path": os.path.realpath(inputFileName), "size": st.st_size, "mtime": st.st_mtime_ns}
+
+def columnKey(inputFileName, encoding, headerNum, column, kind, dateFormat=None):
+	return {
+		"source": sourceInfo(inputFileName),
+		"encoding": encoding,
+		"header": headerNum,
+		"column": column,
+		"kind": kind,
+		"dateFormat": dateFormat,
+	}
+
+def columnPath(inputFileName, key):
+	name = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+	return os.path.join(cacheDirectory(inputFileName), key["kind"] + "-" + name)
+
+def mapArray(fileName, typecode):
+	with open(fileName, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return memoryview(b'').cast(typecode)
+		return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+def iterValues(tags, values):
+	for tag, value in zip(tags, values):
+		if tag == 1:
+			yield int(value)
+		elif tag == 2:
+			yield value
+		else:
+			yield None
+
+def iterTexts(offsets, blob):
+	for k in range(len(offsets) - 1):
+		yield str(blob[offsets[k]:offsets[k + 1]], 'utf-8')
+
+def openColumn(inputFileName, key):
+	# 保存した列を読み込んで、各行の値を順に返すイテレータを返す (保存されていない場合は None)
+	path = columnPath(inputFileName, key)
+	try:
+		with open(path + ".json", 'r') as f:
+			meta = json.load(f)
+		if meta["key"] != key:
+			return None
+		if key["kind"] == "time":
+			return iter(mapArray(path + ".q", 'q'))
+		elif key["kind"] == "value":
+			return iterValues(mapArray(path + ".b", 'b'), mapArray(path + ".d", 'd'))
+		else:
+			return iterTexts(mapArray(path + ".q", 'q'), mapArray(path + ".txt", 'B'))
+	except (OSError, ValueError, KeyError):
+		return None
+
+class ColumnWriter:
+	# 解析した値を受け取り、一定行数ごとに一時ファイルへ書き出し、最後に保存した列として確定する
+	def __init__(self, inputFileName, key):
+		self.inputFileName = inputFileName
+		self.key = key
+		self.path = columnPath(inputFileName, key)
+		self.failed = False
+		self.rows = 0
+		self.files = {}
+		self.buffers = {}
+		os.makedirs(cacheDirectory(inputFileName), exist_ok=True)
+		if key["kind"] == "time":
+			self.open(".q", 'q')
+		elif key["kind"] == "value":
+			self.open(".b", 'b')
+			self.open(".d", 'd')
+		else:
+			self.open(".q", 'q')
+			self.open(".txt", 'B')
+			self.buffers[".q"].append(0)
+			self.textOffset = 0
+
+	def open(self, suffix, typecode):
+		self.files[suffix] = open(self.path + suffix + ".tmp", 'wb')
+		self.buffers[suffix] = array.array(typecode)
+
+	def append(self, value):
+		kind = self.key["kind"]
+		if kind == "time":
+			self.buffers[".q"].append(value)
+		elif kind == "value":
+			if value is None:
+				self.buffers[".b"].append(0)
+				self.buffers[".d"].append(0.0)
+			elif isinstance(value, int):
+				if not -exactIntLimit < value < exactIntLimit:
+					self.failed = True
+				self.buffers[".b"].append(1)
+				self.buffers[".d"].append(value if not self.failed else 0.0)
+			else:
+				self.buffers[".b"].append(2)
+				self.buffers[".d"].append(value)
+		else:
+			data = value.encode('utf-8')
+			self.textOffset += len(data)
+			self.buffers[".txt"].frombytes(data)
+			self.buffers[".q"].append(self.textOffset)
+		self.rows += 1
+		if self.rows % flushRows == 0:
+			self.flush()
+
+	def flush(self):
+		for suffix in self.files:
+			self.buffers[suffix].tofile(self.files[suffix])
+			del self.buffers[suffix][:]
+
+	def commit(self):
+		if self.failed:
+			self.abort()
+			return
+		self.flush()
+		for suffix in self.files:
+			self.files[suffix].close()
+			os.replace(self.path + suffix + ".tmp", self.path + suffix)
+		removeStale(self.inputFileName)
+		# 設定を書いたファイルを最後に置き、これがあるものだけを有効とする
+		with open(self.path + ".json.tmp", 'w') as f:
+			json.dump({"key": self.key, "rows": self.rows}, f)
+		os.replace(self.path + ".json.tmp", self.path + ".json")
+
+	def abort(self):
+		for suffix in self.files:
+			self.files[suffix].close()
+			try:
+				os.remove(self.path + suffix + ".tmp")
+			except OSError:
+				pass
+
+def removeStale(inputFileName):
+	# 現在の入力ファイルと一致しなくなった保存結果を削除する
+	directory = cacheDirectory(inputFileName)
+	source = sourceInfo(inputFileName)
+	for name in os.listdir(directory):
+		if not name.endswith(".json"):
+			continue
+		try:
+			with open(os.path.join(directory, name), 'r') as f:
+				stale = json.load(f)["key"]["source"] != source
+		except (OSError, ValueError, KeyError):
+			stale = True
+		if stale:
+			base = os.path.join(directory, name[:-len(".json")])
+			for suffix in [".json", ".q", ".b", ".d", ".txt"]:
+				try:
+					os.remove(base + suffix)
+				except OSError:
+					pass
@@ -0,0 +1,170 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# CSV の各行から指定した列だけを取り出す
+# " を含まない行は区切り文字で分割するだけで済ませ、必要な列より後ろは分割しない
+# " を含む行は、" で始まる列が閉じるまで次の行をつなげて csv モジュールで解析する
+# (csv モジュールと同様に、列の途中の " は囲みではなく普通の文字として扱う)
+# UTF-8 / ASCII の入力は、文字列に変換せずバイト列のまま分割し、取り出した列だけを変換する
+
+import codecs
+import csv
+import io
+import itertools
+import locale
+
+rawEncodings = ["utf-8", "ascii"]
+# recordEnds で一度に読む大きさ
+recordBlockSize = 1024 * 1024
+
+def rawEncoding(encoding):
+	# バイト列のまま分割できる文字コードなら正規化した名前を、そうでなければ None を返す
+	if encoding is None:
+		encoding = locale.getpreferredencoding(False)
+	name = codecs.lookup(encoding).name
+	return name if name in rawEncodings else None
+
+def endsInQuotes(line, comma, quote, inQuotes):
+	# line の末尾で " で囲まれた列が閉じていないかを返す (inQuotes は行頭で閉じていないかどうか)
+	pos = 0
+	while True:
+		if inQuotes:
+			end = line.find(quote, pos)
+			if end < 0:
+				return True
+			if line[end + 1:end + 2] == quote:
+				# "" は囲みの中の " を表す
+				pos = end + 2
+				continue
+			inQuotes = False
+			pos = end + 1
+		elif line[pos:pos + 1] == quote:
+			inQuotes = True
+			pos += 1
+			continue
+		# 囲まれていない部分は、次の列の先頭まで読み飛ばす
+		pos = line.find(comma, pos)
+		if pos < 0:
+			return False
+		pos += 1
+
+def recordEnds(f, end=None):
+	# バイナリモードで開いたファイルを現在位置 (レコードの先頭) から end まで読み、
+	# 改行で終わる各レコードの直後の位置を順に返す (改行で終わっていない最後のレコードは含まない)
+	pos = f.tell()
+	inQuotes = False
+	rest = b''
+	while end is None or pos < end:
+		block = f.read(recordBlockSize if end is None else min(recordBlockSize, end - pos))
+		if len(block) == 0:
+			break
+		base = pos - len(rest)
+		pos += len(block)
+		data = rest + block
+		last = data.rfind(b'\n') + 1
+		rest = data[last:]
+		start = 0
+		if not inQuotes and data.find(b'"', 0, last) < 0:
+			# " を含まない部分は、全ての改行がレコードの区切りになる
+			while start < last:
+				start = data.find(b'\n', start) + 1
+				yield base + start
+			continue
+		while start < last:
+			lineEnd = data.find(b'\n', start) + 1
+			if inQuotes or data.find(b'"', start, lineEnd) >= 0:
+				inQuotes = endsInQuotes(data[start:lineEnd], b',', b'"', inQuotes)
+			if not inQuotes:
+				yield base + lineEnd
+			start = lineEnd
+
+def projectLines(lines, columns, encoding=None):
+	# lines は行ごとの文字列 (encoding が None のとき) またはバイト列
+	# columns は取り出す列の番号 (0始まり) のリストで、この順に並べたリストを行ごとに返す
+	if encoding is None:
+		comma, quote, lf, cr, crlf, empty = ',', '"', '\n', '\r', '\r\n', ''
+	else:
+		comma, quote, lf, cr, crlf, empty = b',', b'"', b'\n', b'\r', b'\r\n', b''
+	maxSplit = max(columns) + 1 if len(columns) > 0 else 0
+	lines = iter(lines)
+	for line in lines:
+		if quote in line:
+			record = [line]
+			inQuotes = endsInQuotes(line, comma, quote, False)
+			while inQuotes:
+				line = next(lines, None)
+				if line is None:
+					break
+				record.append(line)
+				inQuotes = endsInQuotes(line, comma, quote, True)
+			if encoding is not None:
+				record = [x.decode(encoding) for x in record]
+			for row in csv.reader(record):
+				yield [row[c] for c in columns]
+			continue
+		fields = line.split(comma, maxSplit)
+		if len(fields) <= maxSplit:
+			# 行末の列まで分割した場合のみ、改行を取り除く
+			last = fields[-1]
+			if last.endswith(lf):
+				last = last[:-2] if last.endswith(crlf) else last[:-1]
+			elif last.endswith(cr):
+				last = last[:-1]
+			fields[-1] = last
+			# csv モジュールと同様に、空の行は列がないものとする
+			if len(fields) == 1 and last == empty:
+				fields = []
+		if encoding is None:
+			yield [fields[c] for c in columns]
+		else:
+			yield [fields[c].decode(encoding) for c in columns]
+
+def skipLines(lines, count, encoding=None):
+	# lines から count 個のレコードを読み飛ばし、残りの行のイテレータを返す
+	# 列は取り出さないため、ヘッダ行の列が少なくてもよい
+	lines = iter(lines)
+	for row in itertools.islice(projectLines(lines, [], encoding), count):
+		pass
+	return lines
+
+def projectRows(rows, columns):
+	# 解析済みの行 (chain.py の前の段の出力など) から、projectLines と同様に指定した列を取り出す
+	for row in rows:
+		yield [row[c] for c in columns]
+
+def openLines(f, encoding=None):
+	# バイナリモードで開いたファイルを、projectLines に渡す行の読み込み元とその文字コードの組にする
+	raw = rawEncoding(encoding)
+	if raw is not None:
+		return f, raw
+	if encoding is None:
+		encoding = locale.getpreferredencoding(False)
+	return io.TextIOWrapper(f, encoding=encoding, newline=''), None
+
+def projectFile(f, columns, encoding=None):
+	# バイナリモードで開いたファイルから、指定した列を行ごとに返す
+	lines, lineEncoding = openLines(f, encoding)
+	return projectLines(lines, columns, lineEncoding)
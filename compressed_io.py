@@ -0,0 +1,224 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# gzip / bzip2 / xz で圧縮されたファイルの読み書き
+# 入力は先頭のバイト列、出力は拡張子で圧縮形式を判定する
+# 圧縮・展開は別のスレッドで行い、CSV の処理と並行して進める
+
+import atexit
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import stat
+import threading
+
+compressMagics = [
+	(b'\x1f\x8b', "gzip"),
+	(b'BZh', "bzip2"),
+	(b'\xfd7zXZ\x00', "xz"),
+]
+compressExtensions = {".gz": "gzip", ".bz2": "bzip2", ".xz": "xz"}
+# 圧縮レベルの省略時の値 (各コマンドの既定値に合わせる)
+defaultLevels = {"gzip": 6, "bzip2": 9, "xz": 6}
+chunkSize = 1024 * 1024
+# スレッド間で受け渡すまとまりの最大数
+queueChunks = 4
+
+def headCompression(head):
+	for magic, compression in compressMagics:
+		if head.startswith(magic):
+			return compression
+	return None
+
+def inputCompression(fileName):
+	# パイプなど通常のファイル以外は、先頭を読むとその分が失われるため、ここでは判定しない
+	# (openInput では開いたファイルの先頭を読まずに覗いて判定する)
+	if not stat.S_ISREG(os.stat(fileName).st_mode):
+		return None
+	with open(fileName, 'rb') as f:
+		return headCompression(f.read(6))
+
+def outputCompression(fileName):
+	for extension, compression in compressExtensions.items():
+		if fileName.endswith(extension):
+			return compression
+	return None
+
+def openDecompressor(f, compression):
+	if compression == "gzip":
+		return gzip.open(f, 'rb')
+	elif compression == "bzip2":
+		return bz2.open(f, 'rb')
+	return lzma.open(f, 'rb')
+
+def openCompressor(fileName, compression, level):
+	if level is None:
+		level = defaultLevels[compression]
+	if compression == "gzip":
+		return gzip.open(fileName, 'wb', compresslevel=level)
+	elif compression == "bzip2":
+		return bz2.open(fileName, 'wb', compresslevel=max(level, 1))
+	return lzma.open(fileName, 'wb', preset=level)
+
+class ThreadedReader(io.RawIOBase):
+	# 別のスレッドで展開したデータを順に返す (閉じるときは展開元の file も閉じる)
+	def __init__(self, source, file):
+		self.source = source
+		self.file = file
+		self.chunks = queue.Queue(queueChunks)
+		self.pending = b''
+		self.position = 0
+		self.finished = False
+		self.stopped = False
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		# 閉じずに終了した場合も、終了処理の前にスレッドを止める
+		atexit.register(self.close)
+
+	def run(self):
+		try:
+			while not self.stopped:
+				chunk = self.source.read(chunkSize)
+				self.chunks.put(chunk)
+				if len(chunk) == 0:
+					break
+		except Exception as e:
+			self.chunks.put(e)
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		if len(self.pending) == 0:
+			if self.finished:
+				return 0
+			chunk = self.chunks.get()
+			if isinstance(chunk, Exception):
+				self.finished = True
+				raise chunk
+			if len(chunk) == 0:
+				self.finished = True
+				return 0
+			self.pending = memoryview(chunk)
+		size = min(len(b), len(self.pending))
+		b[:size] = self.pending[:size]
+		self.pending = self.pending[size:]
+		self.position += size
+		return size
+
+	def tell(self):
+		return self.position
+
+	def close(self):
+		if not self.closed:
+			# 展開を途中でやめる場合は、スレッドが待たずに終われるよう取り出しておく
+			self.stopped = True
+			while self.thread.is_alive():
+				try:
+					self.chunks.get(timeout=0.1)
+				except queue.Empty:
+					pass
+			self.source.close()
+			self.file.close()
+			atexit.unregister(self.close)
+		super().close()
+
+class ThreadedWriter(io.RawIOBase):
+	# 書き込まれたデータを別のスレッドで圧縮して書き出す
+	def __init__(self, target):
+		self.target = target
+		self.chunks = queue.Queue(queueChunks)
+		self.error = None
+		self.position = 0
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		atexit.register(self.close)
+
+	def run(self):
+		while True:
+			chunk = self.chunks.get()
+			if chunk is None:
+				break
+			if self.error is not None:
+				continue
+			try:
+				self.target.write(chunk)
+			except Exception as e:
+				self.error = e
+
+	def writable(self):
+		return True
+
+	def write(self, b):
+		if self.error is not None:
+			raise self.error
+		self.chunks.put(bytes(b))
+		self.position += len(b)
+		return len(b)
+
+	def tell(self):
+		return self.position
+
+	def close(self):
+		if not self.closed:
+			self.chunks.put(None)
+			self.thread.join()
+			atexit.unregister(self.close)
+			try:
+				self.target.close()
+			except Exception as e:
+				if self.error is None:
+					self.error = e
+			super().close()
+			if self.error is not None:
+				raise self.error
+
+def openInput(fileName):
+	# 入力ファイルをバイナリモードで開く (圧縮されている場合は展開したデータを返す)
+	# パイプなどからも読めるよう、ファイルは1回だけ開き、圧縮形式は先頭を覗いて判定する
+	f = open(fileName, 'rb')
+	compression = headCompression(f.peek(6)[:6])
+	if compression is None:
+		return f
+	return io.BufferedReader(ThreadedReader(openDecompressor(f, compression), f), chunkSize)
+
+def openOutput(fileName, level=None):
+	# 出力ファイルをバイナリモードで開く (拡張子が圧縮形式のものなら圧縮して書き出す)
+	compression = outputCompression(fileName)
+	if compression is None:
+		return open(fileName, 'wb')
+	return io.BufferedWriter(ThreadedWriter(openCompressor(fileName, compression, level)), chunkSize)
+
+def openTextInput(fileName, encoding):
+	return io.TextIOWrapper(openInput(fileName), encoding=encoding, newline='')
+
+def openTextOutput(fileName, encoding, level=None):
+	if outputCompression(fileName) is None:
+		return open(fileName, 'w', newline='', encoding=encoding)
+	return io.TextIOWrapper(openOutput(fileName, level), encoding=encoding, newline='')
@@ -34,6 +34,9 @@ options:
   -o <file> / --output-file <file> : 出力ファイル名を設定 (省略時標準出力)
   --input-encode <encode>          : 入力文字コードを設定 (省略時システム標準)
   --output-encode <encode>         : 出力文字コードを設定 (省略時システム標準)
+  --compress-level <num>           : 圧縮して出力する場合の圧縮レベルを設定 (0～9、省略時 gzip / xz は6、bzip2 は9)
+    入力ファイルが gzip / bzip2 / xz で圧縮されている場合は、別のスレッドで展開しながら読み込む。
+    出力ファイル名の拡張子が .gz / .bz2 / .xz の場合は、別のスレッドで圧縮しながら書き出す。
 
   --header <num>                   : ヘッダ行数を設定 (省略時0)
 
@@ -43,42 +46,116 @@ options:
   -s <col-num> / --sum <col-num>   : 累積和を出力する列を指定
   -a <col-num> <width> / --ma <col-num> <width> : 移動平均を出力する列を指定
   --smooth <col-num> <alpha>       : 急な変化を抑えたデータを出力する列を指定
+  --rmin <col-num> <width>         : 移動最小値を出力する列を指定
+  --rmax <col-num> <width>         : 移動最大値を出力する列を指定
+  --rstd <col-num> <width>         : 移動標準偏差 (標本標準偏差) を出力する列を指定 (width は2以上)
+  --rmedian <col-num> <width>      : 移動中央値を出力する列を指定
 
-ファイル名・文字コード・ヘッダ行数は、それぞれ0回か1回のみ設定可能。
-出力指定(-f, -c, -s, -a)は何回でも指定でき、指定した順で出力される。
+  --batch <rows>                   : 指定した行数ごとにまとめて計算する
+    NumPy が利用できる場合のみ有効で、利用できない場合は通常通り1行ずつ計算する。
+    移動平均と急な変化を抑えたデータは、浮動小数点数の丸め誤差により
+    1行ずつ計算した場合と末尾の桁が異なることがある (移動平均の誤差は窓の中の値の分のみで、行数によって積み重ならない)。
+    移動最小値・移動最大値・移動標準偏差・移動中央値は、--batch 指定時も1行ずつ計算する。
+
+  --follow                         : 入力を待ち受けながら、届いた行から順に出力する
+    入力がファイルの場合、末尾に到達しても終了せず、追記されたデータを待つ。
+    入力がパイプなどの場合、入力が終わるまで処理を続ける。
+    Ctrl-C や kill (SIGTERM) で中断したときも、入力が終わったときと同様に終了する。
+    終了時に、ヘッダ行を除くデータ行の入力から出力までの遅延の統計を標準エラー出力に表示する。
+  --flush-interval <ms>            : --follow 指定時に出力を書き出す間隔を設定 (省略時0)
+    0 のときは1行ごとに書き出す。
+    入力が途切れたときは、間隔に関わらずその時点で書き出す。
+  --poll-interval <ms>             : --follow 指定時に追記を確認する間隔を設定 (省略時100)
+
+  --cache                          : 出力に使う列を解析した結果を保存し、次回以降はそれを読み込む
+    解析結果は入力ファイルと同じ場所の (入力ファイル名).colcache ディレクトリに保存し、
+    入力ファイルのサイズ・更新時刻や、文字コード・ヘッダ行数・列が変わると作り直す。
+    入力ファイル名の指定が必要。--follow とは同時に指定できない。
+
+  --pipelined                      : 読み込みと書き込みを別のスレッドで行い、計算と並行して進める
+    --follow とは同時に指定できない。
+  --stats                          : 処理にかかった時間や件数などを標準エラー出力に表示する
+    読み込み・値の解析 (--batch 指定時はまとめた計算)・書き込みの各段階の時間と、
+    数値として解析できなかったセルの数、ピーク時の使用メモリ量などを表示する。
+  --stats-file <file>              : --stats の結果を JSON 形式でファイルに保存する
+  --stats-sample <ms>              : --stats の結果に、指定した間隔 (CPU 時間) で記録した実行中の箇所を加える
+
+ファイル名・文字コード・圧縮レベル・ヘッダ行数・まとめて計算する行数・各間隔・--stats-file・--stats-sample は、それぞれ0回か1回のみ設定可能。
+出力指定(-l, -f, -c, -s, -a, --smooth, --rmin, --rmax, --rstd, --rmedian)は何回でも指定でき、指定した順で出力される。
 列の指定は一番左の列を1列目とする。
 出力する行番号は1始まりで、ヘッダ行は含まない。
 
 「急な変化を抑えたデータ」とは、0以上1以下の値alphaを用いて
 「前回の出力値×(1-alpha) + 今回の入力値×alpha」で計算される値であり、
 alphaが1に近いほど変化が早く反映される。
-""".strip()
 
-def toValue(inStr):
-	ret = None
-	try:
-		ret = int(inStr)
-	except ValueError:
-		try:
-			ret = float(inStr)
-		except ValueError:
-			pass
-	return ret
+移動平均・移動最小値・移動最大値・移動標準偏差・移動中央値は、数値として解析できた直近width個の値から計算し、
+値がwidth個そろうまでは空欄を出力する。
+""".strip()
 
 import sys
-import codecs
+import atexit
 import csv
+import io
+import itertools
+import math
+import os
+import select
+import signal
+import stat
+import time
+
+import column_cache
+import compressed_io
+import column_reader
+import pipeline
+import rolling
+import run_stats
+import stage_io
+import value_parser
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+toValue = value_parser.toValue
 
 inputFileName = None
 outputFileName = None
 inputEncode = None
 outputEncode = None
 headerNum = None
+batchRows = None
+follow = False
+flushInterval = None
+pollInterval = None
+useCache = False
+statsEnabled = False
+statsFileName = None
+statsSample = None
+compressLevel = None
+pipelined = False
 outputs = []
 
+# 移動最小値などの出力指定と、それぞれを計算するクラス
+rollingOptions = {
+	'--rmin': rolling.RollingMin,
+	'--rmax': rolling.RollingMax,
+	'--rstd': rolling.RollingStd,
+	'--rmedian': rolling.RollingMedian,
+}
+rollingNames = {'rmin': 'min', 'rmax': 'max', 'rstd': 'std', 'rmedian': 'median'}
+
+def makeRolling(o):
+	return rollingOptions['--' + o[0]](o[2])
+
+# chain.py の段として動く場合は、その段のオプションと前後の段との受け渡しを使う
+stage = stage_io.current()
+
 i = 1
-argc = len(sys.argv)
-argv = sys.argv
+argv = sys.argv if stage is None else stage.argv
+argc = len(argv)
 try:
 	while i < argc:
 		if argv[i] == '-h' or argv[i] == '--help':
@@ -121,6 +198,68 @@ try:
 			headerNum = int(argv[i])
 			if headerNum < 0:
 				raise Exception("header count must be non-negative")
+		elif argv[i] == '--batch':
+			if batchRows is not None:
+				raise Exception("multiple --batch")
+			if i + 1 >= argc:
+				raise Exception("missing batch row count")
+			i += 1
+			batchRows = int(argv[i])
+			if batchRows <= 0:
+				raise Exception("batch row count must be positive")
+		elif argv[i] == '--follow':
+			follow = True
+		elif argv[i] == '--flush-interval':
+			if flushInterval is not None:
+				raise Exception("multiple --flush-interval")
+			if i + 1 >= argc:
+				raise Exception("missing flush interval")
+			i += 1
+			flushInterval = float(argv[i])
+			if flushInterval < 0:
+				raise Exception("flush interval must be non-negative")
+		elif argv[i] == '--poll-interval':
+			if pollInterval is not None:
+				raise Exception("multiple --poll-interval")
+			if i + 1 >= argc:
+				raise Exception("missing poll interval")
+			i += 1
+			pollInterval = float(argv[i])
+			if pollInterval <= 0:
+				raise Exception("poll interval must be positive")
+		elif argv[i] == '--cache':
+			useCache = True
+		elif argv[i] == '--compress-level':
+			if compressLevel is not None:
+				raise Exception("multiple --compress-level")
+			if i + 1 >= argc:
+				raise Exception("missing compression level")
+			i += 1
+			compressLevel = int(argv[i])
+			if compressLevel < 0 or 9 < compressLevel:
+				raise Exception("compression level must be between 0 and 9")
+		elif argv[i] == '--pipelined':
+			pipelined = True
+		elif argv[i] == '--stats':
+			statsEnabled = True
+		elif argv[i] == '--stats-file':
+			if statsFileName is not None:
+				raise Exception("multiple --stats-file")
+			if i + 1 >= argc:
+				raise Exception("missing stats file name")
+			i += 1
+			statsFileName = argv[i]
+			statsEnabled = True
+		elif argv[i] == '--stats-sample':
+			if statsSample is not None:
+				raise Exception("multiple --stats-sample")
+			if i + 1 >= argc:
+				raise Exception("missing sampling interval")
+			i += 1
+			statsSample = float(argv[i])
+			if statsSample <= 0:
+				raise Exception("sampling interval must be positive")
+			statsEnabled = True
 		elif argv[i] == '-l' or argv[i] == '--lineno':
 			outputs.append(['l'])
 		elif argv[i] == '-f' or argv[i] == '--fix':
@@ -166,84 +305,510 @@ try:
 			if alpha < 0 or 1 < alpha:
 				raise Exception("alpha must be between 0 and 1")
 			outputs.append(['smooth', col - 1, alpha])
+		elif argv[i] in rollingOptions:
+			name = argv[i][2:]
+			if i + 2 >= argc:
+				raise Exception("missing column number or width for " + name)
+			i += 2
+			col = int(argv[i - 1])
+			width = int(argv[i])
+			if col <= 0:
+				raise Exception("column number must be positive")
+			if width <= 0 or (name == 'rstd' and width < 2):
+				raise Exception(name + " width must be " + ("at least 2" if name == 'rstd' else "positive"))
+			outputs.append([name, col - 1, width])
 		else:
 			raise Exception("unknown option " + argv[i])
 		i += 1
+	if useCache and inputFileName is None:
+		raise Exception("--cache requires -i or --input-file")
+	if useCache and follow:
+		raise Exception("--cache cannot be used with --follow")
+	if follow and pipelined:
+		raise Exception("--pipelined cannot be used with --follow")
+	if follow and inputFileName is not None and compressed_io.inputCompression(inputFileName) is not None:
+		raise Exception("compressed input cannot be used with --follow")
+	if follow and outputFileName is not None and compressed_io.outputCompression(outputFileName) is not None:
+		raise Exception("compressed output cannot be used with --follow")
+	stage_io.checkOptions(stage, inputFileName is not None or inputEncode is not None,
+		outputFileName is not None or outputEncode is not None or compressLevel is not None, pipelined, statsSample)
+	if stage is not None and stage.chained and follow:
+		raise Exception("--follow cannot be used in a chain stage")
+	stats = None
+	if statsEnabled:
+		stats = run_stats.Stats("copy_add_ma.py")
+		if statsSample is not None:
+			stats.startSampling(statsSample)
 except Exception as e:
 	sys.stderr.write('error: ' + str(e) + '\n')
 	sys.exit(1)
 
-inputFile = open(inputFileName, 'r', newline='') if inputFileName is not None else sys.stdin
-outputFile = open(outputFileName, 'w', newline='') if outputFileName is not None else sys.stdout
-if outputFileName is None:
-	sys.stdout.reconfigure(newline='')
+# 入力からは出力に使う列のみを取り出し、各出力の列番号を取り出した列の中の位置に置き換える
+inputColumns = sorted(set(o[1] for o in outputs if o[0] != 'l' and o[0] != 'f'))
+for o in outputs:
+	if o[0] != 'l' and o[0] != 'f':
+		o[1] = inputColumns.index(o[1])
 
-inputFileReader = codecs.getreader(inputEncode)(inputFile) if inputEncode is not None else inputFile
-outputFileWriter = codecs.getwriter(outputEncode)(outputFile) if outputEncode is not None else outputFile
+inputFile = None
+outputFile = None
+if stage is not None and stage.input is not None:
+	csvReader = column_reader.projectRows(stage.input.rows(), inputColumns)
+else:
+	inputFile = compressed_io.openInput(inputFileName) if inputFileName is not None else sys.stdin.buffer
+	if inputEncode is None and inputFileName is None:
+		inputEncode = sys.stdin.encoding
+	inputLines, lineEncoding = column_reader.openLines(inputFile, inputEncode)
+	if pipelined:
+		inputLines = pipeline.readAhead(inputLines)
+	csvReader = column_reader.projectLines(inputLines, inputColumns, lineEncoding)
+if stage is not None and stage.output is not None:
+	csvWriter = stage.output
+else:
+	outputFile = compressed_io.openTextOutput(outputFileName, outputEncode, compressLevel) if outputFileName is not None else sys.stdout
+	if outputFileName is None:
+		sys.stdout.reconfigure(newline='', encoding=outputEncode)
+	csvWriter = csv.writer(outputFile)
+pipelineWriter = None
+if pipelined:
+	pipelineWriter = pipeline.PipelinedWriter(csvWriter.writerows)
+	csvWriter = pipelineWriter
 
-csvReader = csv.reader(inputFileReader)
-csvWriter = csv.writer(outputFileWriter)
+class FollowWriter:
+	# 出力した行を、間隔が空いたときや入力が途切れたときに書き出し、遅延を記録する
+	# 最初の headerRows 行はヘッダ行として、遅延の記録に含めない
+	def __init__(self, outputFile, flushInterval, headerRows):
+		self.outputFile = outputFile
+		self.csvWriter = csv.writer(outputFile)
+		self.flushInterval = flushInterval
+		self.headerRows = headerRows
+		self.lastFlush = time.perf_counter()
+		self.inputTime = None
+		self.pendingRows = 0
+		self.pendingTimes = []
+		self.latencyCount = 0
+		self.latencySum = 0.0
+		self.latencyMax = 0.0
+		self.finished = False
 
-lineNo = 0
-processBuffer = [[] if x[0] == 'm' else (None if x[0] == 'smooth' else 0) for x in outputs]
-for row in csvReader:
-	lineNo += 1
+	def writerow(self, row):
+		self.csvWriter.writerow(row)
+		self.pendingRows += 1
+		if self.headerRows > 0:
+			self.headerRows -= 1
+		else:
+			self.pendingTimes.append(self.inputTime)
+		if time.perf_counter() - self.lastFlush >= self.flushInterval:
+			self.flush()
+
+	def flush(self):
+		if self.pendingRows == 0:
+			return
+		self.outputFile.flush()
+		now = time.perf_counter()
+		for t in self.pendingTimes:
+			latency = now - t
+			self.latencyCount += 1
+			self.latencySum += latency
+			if latency > self.latencyMax:
+				self.latencyMax = latency
+		self.pendingRows = 0
+		self.pendingTimes = []
+		self.lastFlush = now
+
+	def finish(self):
+		# 残りの行を書き出して遅延を表示する (途中で止めた場合も終了時に1回だけ行う)
+		if self.finished:
+			return
+		self.finished = True
+		try:
+			self.flush()
+		except (OSError, ValueError):
+			pass
+		if self.latencyCount > 0:
+			sys.stderr.write('latency: {0} rows, mean {1:.3f} ms, max {2:.3f} ms\n'.format(
+				self.latencyCount, self.latencySum / self.latencyCount * 1000, self.latencyMax * 1000))
+
+def inputReady(f):
+	try:
+		return len(select.select([f], [], [], 0)[0]) > 0
+	except (OSError, ValueError):
+		return False
+
+def followLines(f, followWriter):
+	# 通常のファイルは末尾で追記を待ち、それ以外は入力の終わりで終了する
+	isFile = stat.S_ISREG(os.fstat(f.fileno()).st_mode)
+	pending = ''
+	try:
+		while True:
+			if not isFile and not inputReady(f):
+				followWriter.flush()
+			line = f.readline()
+			if len(line) == 0:
+				if not isFile:
+					break
+				followWriter.flush()
+				time.sleep(pollInterval / 1000)
+				continue
+			pending += line
+			if isFile and not pending.endswith('\n'):
+				continue
+			followWriter.inputTime = time.perf_counter()
+			yield pending
+			pending = ''
+	except KeyboardInterrupt:
+		return
+	if len(pending) > 0:
+		followWriter.inputTime = time.perf_counter()
+		yield pending
+
+def stopFollowing(signum, frame):
+	raise KeyboardInterrupt()
+
+if follow:
+	if flushInterval is None: flushInterval = 0
+	if pollInterval is None: pollInterval = 100
+	csvWriter = FollowWriter(outputFile, flushInterval / 1000, headerNum or 0)
+	atexit.register(csvWriter.finish)
+	# kill などで止めた場合も、Ctrl-C と同様に入力の待ち受けをやめて終了する
+	signal.signal(signal.SIGTERM, stopFollowing)
+	csvReader = column_reader.projectLines(followLines(io.TextIOWrapper(inputFile, encoding=inputEncode, newline=''), csvWriter), inputColumns)
+
+def makeHeaderRow(row, lineNo):
 	outRow = []
-	if headerNum is not None and lineNo <= headerNum:
-		for o in outputs:
-			if o[0] == 'l':
-				outRow.append('lineno')
-			elif o[0] == 'f':
-				outRow.append(o[1])
-			elif lineNo == 1 and o[0] == 's':
-				outRow.append('sum of ' + row[o[1]])
-			elif lineNo == 1 and o[0] == 'm':
-				outRow.append('{0}-MA of {1}'.format(o[2], row[o[1]]))
-			elif lineNo == 1 and o[0] == 'smooth':
-				outRow.append('smoothed(alpha={0}) of {1}'.format(o[2], row[o[1]]))
-			else:
-				outRow.append(row[o[1]])
+	for o in outputs:
+		if o[0] == 'l':
+			outRow.append('lineno')
+		elif o[0] == 'f':
+			outRow.append(o[1])
+		elif lineNo == 1 and o[0] == 's':
+			outRow.append('sum of ' + row[o[1]])
+		elif lineNo == 1 and o[0] == 'm':
+			outRow.append('{0}-MA of {1}'.format(o[2], row[o[1]]))
+		elif lineNo == 1 and o[0] == 'smooth':
+			outRow.append('smoothed(alpha={0}) of {1}'.format(o[2], row[o[1]]))
+		elif lineNo == 1 and o[0] in rollingNames:
+			outRow.append('{0}-{1} of {2}'.format(o[2], rollingNames[o[0]], row[o[1]]))
+		else:
+			outRow.append(row[o[1]])
+	return outRow
+
+# NumPy で浮動小数点数として正確に扱える整数の範囲
+exactIntLimit = 2 ** 53
+
+def cumulativeSumBatch(total, values, data, isInt):
+	# 整数同士の和は整数のまま、浮動小数点数が現れた後は浮動小数点数として累積する
+	out = []
+	head = len(values) if isInt.all() else int(numpy.argmin(isInt))
+	if isinstance(total, int) and head > 0:
+		if data is not None and abs(total) + numpy.abs(data[:head]).sum() < exactIntLimit:
+			out = (numpy.cumsum(data[:head]) + total).astype(numpy.int64).tolist()
+		else:
+			out = list(itertools.accumulate(values[:head], initial=total))[1:]
+		total = out[-1]
+	elif not isinstance(total, int):
+		head = 0
+	if head < len(values):
+		if data is None:
+			out.extend(itertools.accumulate(values[head:], initial=total))
+			del out[head]
+		else:
+			rest = data[head:].copy()
+			rest[0] = total + values[head]
+			out.extend(numpy.cumsum(rest).tolist())
+		total = out[-1]
+	return total, out
+
+def movingAverageBatch(tail, values, data, isInt, width):
+	# tail は直前までの有効な値のうち最後の (width - 1) 個
+	window = tail + values
+	newTail = window[max(0, len(window) - width + 1):] if width > 1 else []
+	if len(window) < width:
+		return newTail, [''] * len(values)
+	x = None
+	if data is not None:
+		x = numpy.concatenate((numpy.array(tail, dtype=numpy.float64), data))
+		if isInt.any() or any(type(v) is int for v in tail):
+			if not numpy.isfinite(x).all() or numpy.abs(x).sum() >= exactIntLimit:
+				x = None
+	if x is None:
+		means = []
+		total = 0
+		for k in range(len(window)):
+			total += window[k]
+			if k >= width:
+				total -= window[k - width]
+			if k >= width - 1:
+				means.append(total / width)
+	elif width <= 64 or not numpy.isfinite(x).all():
+		means = (numpy.convolve(x, numpy.ones(width), 'valid') / width).tolist()
 	else:
-		for i in range(len(outputs)):
-			o = outputs[i]
-			if o[0] == 'l':
-				outRow.append(lineNo if headerNum is None else (lineNo - headerNum))
-			elif o[0] == 'f':
-				outRow.append(o[1])
-			elif o[0] == 's':
-				v = toValue(row[o[1]])
-				if v is None:
-					outRow.append('')
-				else:
-					processBuffer[i] += v
-					outRow.append(processBuffer[i])
+		# 全体の累積和の差を取ると誤差が積み重なるため、width 個ずつのブロックに分けて、
+		# 各窓の合計をブロック内の先頭からの和と、直前のブロックの末尾までの和から求める
+		blockCount = -(-len(x) // width)
+		blocks = numpy.zeros(blockCount * width)
+		blocks[:len(x)] = x
+		blocks = blocks.reshape(blockCount, width)
+		prefix = numpy.cumsum(blocks, axis=1)
+		suffix = numpy.zeros((blockCount, width))
+		suffix[:, :-1] = numpy.cumsum(blocks[:, :0:-1], axis=1)[:, ::-1]
+		sums = numpy.concatenate((prefix[0, width - 1:], (prefix[1:] + suffix[:-1]).ravel()))
+		means = (sums[:len(x) - width + 1] / width).tolist()
+	return newTail, [''] * (len(values) - len(means)) + means
+
+def smoothBatch(prev, values, data, alpha):
+	out = []
+	if prev is None:
+		if len(values) == 0:
+			return prev, out
+		prev = values[0]
+		out.append(prev)
+		values = values[1:]
+		if data is not None:
+			data = data[1:]
+	if len(values) == 0:
+		return prev, out
+	beta = 1.0 - alpha
+	if data is None or beta <= 0.0 or beta >= 1.0:
+		for v in values:
+			prev = prev * beta + v * alpha
+			out.append(prev)
+		return prev, out
+	# y[k] = beta^k * (y[0] + alpha * sum(v[j] / beta^j)) を区間ごとに計算する
+	# beta^k が極端に小さくならないよう、区間の長さを制限する
+	step = max(1, min(256, int(150 / -math.log10(beta))))
+	for begin in range(0, len(data), step):
+		segment = data[begin:begin + step]
+		powers = beta ** numpy.arange(1, len(segment) + 1)
+		ys = powers * (prev + alpha * numpy.cumsum(segment / powers))
+		out.extend(ys.tolist())
+		prev = out[-1]
+	return prev, out
+
+def processBatch(rows, firstLineNo, batchState):
+	columnCache = {}
+	outColumns = []
+	for i in range(len(dataOutputs)):
+		o = dataOutputs[i]
+		if o[0] == 'l':
+			outColumns.append(range(firstLineNo, firstLineNo + len(rows)))
+		elif o[0] == 'f':
+			outColumns.append(itertools.repeat(o[1], len(rows)))
+		elif o[0] == 'c':
+			outColumns.append([row[o[1]] for row in rows])
+		else:
+			if o[1] not in columnCache:
+				allValues = [parseValue(row[o[1]]) for row in rows]
+				validIndex = [k for k in range(len(allValues)) if allValues[k] is not None]
+				values = [allValues[k] for k in validIndex]
+				try:
+					data = numpy.array(values, dtype=numpy.float64)
+				except OverflowError:
+					data = None
+				isInt = numpy.array([type(v) is int for v in values], dtype=bool)
+				columnCache[o[1]] = (validIndex, values, data, isInt)
+			validIndex, values, data, isInt = columnCache[o[1]]
+			if o[0] == 's':
+				batchState[i], results = cumulativeSumBatch(batchState[i], values, data, isInt)
 			elif o[0] == 'm':
-				v = toValue(row[o[1]])
-				if v is None:
-					outRow.append('')
-				else:
-					processBuffer[i].append(v)
-					if len(processBuffer[i]) >= o[2]:
-						processBuffer[i] = processBuffer[i][(len(processBuffer[i]) - o[2]):]
-						sum = 0
-						for pv in processBuffer[i]:
-							sum += pv
-						outRow.append(sum / o[2])
-					else:
-						outRow.append('')
-			elif o[0] == 'smooth':
-				v = toValue(row[o[1]])
-				if v is None:
-					outRow.append('')
-				else:
-					if processBuffer[i] is None:
-						processBuffer[i] = v
-					else:
-						processBuffer[i] = processBuffer[i] * (1.0 - o[2]) + v * o[2]
-					outRow.append(processBuffer[i])
+				batchState[i], results = movingAverageBatch(batchState[i], values, data, isInt, o[2])
+			elif o[0] in rollingNames:
+				results = [batchState[i].push(v) for v in values]
+				results = ['' if v is None else v for v in results]
 			else:
-				outRow.append(row[o[1]])
-	csvWriter.writerow(outRow)
+				batchState[i], results = smoothBatch(batchState[i], values, data, o[2])
+			outColumn = [''] * len(rows)
+			for k, v in zip(validIndex, results):
+				outColumn[k] = v
+			outColumns.append(outColumn)
+	if len(outColumns) == 0:
+		return [[] for row in rows]
+	return zip(*outColumns)
+
+def compileRowFunction(outputs, parseValue):
+	# 出力指定から、1行分の出力を計算する関数のソースを生成する
+	# 各列の値の解析は1行につき1回にまとめ、各出力の状態は生成した関数のクロージャ変数に持つ
+	# parseValue が None の場合は、値が解析済みであるとして扱う
+	namespace = {'parseValue': parseValue}
+	states = []
+	body = []
+	cells = []
+	parsedColumns = set()
+	for i in range(len(outputs)):
+		o = outputs[i]
+		if o[0] == 'l':
+			cells.append('lineNo')
+			continue
+		elif o[0] == 'f':
+			namespace['fixed{0}'.format(i)] = o[1]
+			cells.append('fixed{0}'.format(i))
+			continue
+		elif o[0] == 'c':
+			cells.append('row[{0}]'.format(o[1]))
+			continue
+		v = 'value{0}'.format(o[1])
+		if o[1] not in parsedColumns:
+			parsedColumns.add(o[1])
+			body.append('{0} = {1}'.format(v, 'row[{0}]' if parseValue is None else 'parseValue(row[{0}])').format(o[1]))
+		out = 'out{0}'.format(i)
+		cells.append(out)
+		body.append('if {0} is None:'.format(v))
+		body.append('\t{0} = \'\''.format(out))
+		body.append('else:')
+		if o[0] == 's':
+			states.append(('total{0}'.format(i), '0'))
+			body.append('\ttotal{0} += {1}'.format(i, v))
+			body.append('\t{0} = total{1}'.format(out, i))
+		elif o[0] == 'm':
+			# 窓・次に書き込む位置・窓内のデータ数・窓内の合計
+			states.append(('window{0}'.format(i), '[0] * {0}'.format(o[2])))
+			states.append(('pos{0}'.format(i), '0'))
+			states.append(('count{0}'.format(i), '0'))
+			states.append(('total{0}'.format(i), '0'))
+			body.extend(x.format(i=i, v=v, out=out, width=o[2]) for x in [
+				'\tif count{i} >= {width}:',
+				'\t\ttotal{i} -= window{i}[pos{i}]',
+				'\telse:',
+				'\t\tcount{i} += 1',
+				'\twindow{i}[pos{i}] = {v}',
+				'\ttotal{i} += {v}',
+				'\tpos{i} += 1',
+				'\tif pos{i} >= {width}:',
+				'\t\tpos{i} = 0',
+				# 浮動小数点数の誤差が蓄積しないよう、一周ごとに合計を計算し直す
+				'\t\tif isinstance(total{i}, float):',
+				'\t\t\ttotal{i} = sum(window{i})',
+				'\t{out} = total{i} / {width} if count{i} >= {width} else \'\'',
+			])
+		elif o[0] == 'smooth':
+			states.append(('smooth{0}'.format(i), 'None'))
+			namespace['alpha{0}'.format(i)] = o[2]
+			namespace['beta{0}'.format(i)] = 1.0 - o[2]
+			body.extend(x.format(i=i, v=v, out=out) for x in [
+				'\tif smooth{i} is None:',
+				'\t\tsmooth{i} = {v}',
+				'\telse:',
+				'\t\tsmooth{i} = smooth{i} * beta{i} + {v} * alpha{i}',
+				'\t{out} = smooth{i}',
+			])
+		else:
+			namespace['rolling{0}'.format(i)] = makeRolling(o)
+			body.append('\t{0} = rolling{1}.push({2})'.format(out, i, v))
+			body.append('\tif {0} is None:'.format(out))
+			body.append('\t\t{0} = \'\''.format(out))
+	source = ['def makeRowFunction():']
+	source.extend('\t{0} = {1}'.format(name, init) for name, init in states)
+	source.append('\tdef processRow(row, lineNo):')
+	if len(states) > 0:
+		source.append('\t\tnonlocal ' + ', '.join(name for name, init in states))
+	source.extend('\t\t' + x for x in body)
+	source.append('\t\treturn [{0}]'.format(', '.join(cells)))
+	source.append('\treturn processRow')
+	exec('\n'.join(source), namespace)
+	return namespace['makeRowFunction']()
+
+def identityValue(v):
+	return v
+
+def recordRows(rows, slots, cacheWriters):
+	# 各行を使う列だけの並びに置き換えながら、その値を保存する
+	try:
+		for row in rows:
+			slotRow = [row[col] if kind == 'text' else toValue(row[col]) for col, kind in slots]
+			for cacheWriter, v in zip(cacheWriters, slotRow):
+				cacheWriter.append(v)
+			yield slotRow
+	except BaseException:
+		for cacheWriter in cacheWriters:
+			cacheWriter.abort()
+		raise
+	for cacheWriter in cacheWriters:
+		cacheWriter.commit()
+
+lineNo = 0
+dataOutputs = outputs
+dataRows = csvReader
+parseValue = toValue if stage is None or stage.input is None else stage_io.typedParser(toValue)
+if useCache:
+	# 出力に使う列を (列, 文字列か数値か) の並びにまとめ、各出力の列番号をその位置に置き換える
+	slots = []
+	cacheOutputs = []
+	for o in outputs:
+		if o[0] == 'l' or o[0] == 'f':
+			cacheOutputs.append(o)
+			continue
+		slot = (o[1], 'text' if o[0] == 'c' else 'value')
+		if slot not in slots:
+			slots.append(slot)
+		cacheOutputs.append([o[0], slots.index(slot)] + o[2:])
+	if len(slots) > 0:
+		if headerNum is not None:
+			for row in itertools.islice(csvReader, headerNum):
+				lineNo += 1
+				csvWriter.writerow(makeHeaderRow(row, lineNo))
+		keys = [column_cache.columnKey(inputFileName, inputEncode, headerNum or 0, inputColumns[col], kind) for col, kind in slots]
+		columns = [column_cache.openColumn(inputFileName, key) for key in keys]
+		if None not in columns:
+			dataRows = zip(*columns)
+		else:
+			dataRows = recordRows(csvReader, slots, [column_cache.ColumnWriter(inputFileName, key) for key in keys])
+		dataOutputs = cacheOutputs
+		parseValue = identityValue
+
+useBatch = batchRows is not None and numpy is not None and not follow
+if stats is not None:
+	dataRows = stats.timeIterator("read", dataRows)
+	csvWriter = stats.timeWriter("write", csvWriter)
+	if useBatch:
+		timedValue = parseValue
+		processBatch = stats.timeFunction("batch", processBatch)
+	else:
+		timedValue = stats.timeFunction("toValue", parseValue)
+	def parseValue(inStr):
+		v = timedValue(inStr)
+		if v is None:
+			stats.count("non-numeric cells")
+		return v
+
+if useBatch:
+	batchState = [[] if x[0] == 'm' else (None if x[0] == 'smooth' else (makeRolling(x) if x[0] in rollingNames else 0)) for x in outputs]
+	rows = []
+	for row in dataRows:
+		lineNo += 1
+		if headerNum is not None and lineNo <= headerNum:
+			csvWriter.writerow(makeHeaderRow(row, lineNo))
+		else:
+			rows.append(row)
+			if len(rows) >= batchRows:
+				dataLineNo = lineNo if headerNum is None else (lineNo - headerNum)
+				csvWriter.writerows(processBatch(rows, dataLineNo - len(rows) + 1, batchState))
+				rows = []
+	if len(rows) > 0:
+		dataLineNo = lineNo if headerNum is None else (lineNo - headerNum)
+		csvWriter.writerows(processBatch(rows, dataLineNo - len(rows) + 1, batchState))
+else:
+	processRow = compileRowFunction(dataOutputs, None if parseValue is identityValue else parseValue)
+	for row in dataRows:
+		lineNo += 1
+		if headerNum is not None and lineNo <= headerNum:
+			csvWriter.writerow(makeHeaderRow(row, lineNo))
+			continue
+		csvWriter.writerow(processRow(row, lineNo if headerNum is None else (lineNo - headerNum)))
+
+if follow:
+	csvWriter.finish()
+	atexit.unregister(csvWriter.finish)
+
+if pipelineWriter is not None:
+	pipelineWriter.close()
+
+if stats is not None:
+	stats.rowsRead = lineNo
+	stats.rowsWritten = lineNo
+	stats.bytesRead = run_stats.streamPosition(inputFile)
+	stats.bytesWritten = run_stats.streamPosition(outputFile)
+	stats.report(statsFileName)
 
-inputFile.close()
-outputFile.close()
+if inputFile is not None:
+	inputFile.close()
+if outputFile is not None:
+	outputFile.close()
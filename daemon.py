@@ -0,0 +1,315 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+usage = """
+Usage: ./daemon.py serve [options]
+       ./daemon.py run [options] <tool> [tool options]
+
+serve: ジョブを待ち受けるデーモンとして動く
+  必要なモジュールとスクリプトを読み込んだ状態で待ち受け、ジョブごとに子プロセスを作って実行する。
+  各ジョブの待ち時間と実行時間を標準エラー出力に表示する。
+  Ctrl-C などで終了する。
+
+run: デーモンにジョブを送り、終わるまで待つ
+  tool: reverse (reverse.py) / ma (copy_add_ma.py) / candle (candle.py)
+  tool options は各スクリプトと同じ。
+  標準入力・標準出力・標準エラー出力と作業ディレクトリはそのままジョブに引き継ぎ、
+  ジョブの終了コードで終了する。
+
+options:
+  -h        / --help               : このヘルプを表示
+  --socket <path>                  : 待ち受ける Unix ドメインソケットのパスを設定
+    省略時は $TMPDIR (未設定の場合は /tmp) の csv_kakou-(ユーザーID).sock とする。
+  -j <num>  / --jobs <num>         : serve: 同時に実行するジョブの最大数を設定 (省略時CPU数)
+    それを超えるジョブは、実行中のジョブが終わるまで待つ。
+  --timing                         : run: ジョブの待ち時間と実行時間を標準エラー出力に表示する
+
+ソケットのパス・ジョブの最大数は、それぞれ0回か1回のみ設定可能。
+""".strip()
+
+import json
+import os
+import socket
+import sys
+
+# 要求・応答は1行の JSON で、要求には標準入力・標準出力・標準エラー出力のファイル記述子を添える
+maxMessage = 1024 * 1024
+
+def defaultSocketPath():
+	# tempfile は読み込みに時間がかかるため、クライアントでは使わない
+	return os.path.join(os.environ.get("TMPDIR", "/tmp"), "csv_kakou-{0}.sock".format(os.getuid()))
+
+def receiveLine(conn, data):
+	while not data.endswith(b'\n'):
+		chunk = conn.recv(maxMessage)
+		if len(chunk) == 0:
+			raise Exception("connection closed")
+		data += chunk
+	return json.loads(data.decode('utf-8'))
+
+mode = None
+socketPath = None
+jobs = None
+timing = False
+toolArgs = None
+
+i = 1
+argc = len(sys.argv)
+argv = sys.argv
+try:
+	if argc < 2 or argv[1] == '-h' or argv[1] == '--help':
+		print(usage)
+		sys.exit(0)
+	mode = argv[1]
+	if mode != 'serve' and mode != 'run':
+		raise Exception("unknown mode " + mode)
+	i = 2
+	while i < argc:
+		if argv[i] == '-h' or argv[i] == '--help':
+			print(usage)
+			sys.exit(0)
+		elif argv[i] == '--socket':
+			if socketPath is not None:
+				raise Exception("multiple --socket")
+			if i + 1 >= argc:
+				raise Exception("missing socket path")
+			i += 1
+			socketPath = argv[i]
+		elif mode == 'serve' and (argv[i] == '-j' or argv[i] == '--jobs'):
+			if jobs is not None:
+				raise Exception("multiple -j or --jobs")
+			if i + 1 >= argc:
+				raise Exception("missing number of jobs")
+			i += 1
+			jobs = int(argv[i])
+			if jobs <= 0:
+				raise Exception("number of jobs must be positive")
+		elif mode == 'run' and argv[i] == '--timing':
+			timing = True
+		elif mode == 'run' and not argv[i].startswith('-'):
+			toolArgs = argv[i:]
+			break
+		else:
+			raise Exception("unknown option " + argv[i])
+		i += 1
+	if mode == 'run' and toolArgs is None:
+		raise Exception("missing tool")
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+if socketPath is None : socketPath = defaultSocketPath()
+if jobs is None : jobs = os.cpu_count() or 1
+
+if mode == 'run':
+	# クライアントは、起動を速くするため重いモジュールを読み込まない
+	try:
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		client.connect(socketPath)
+		request = json.dumps({"argv": toolArgs, "cwd": os.getcwd()}) + '\n'
+		socket.send_fds(client, [request.encode('utf-8')], [0, 1, 2])
+		response = receiveLine(client, b'')
+	except KeyboardInterrupt:
+		sys.exit(130)
+	except Exception as e:
+		sys.stderr.write('error: ' + str(e) + '\n')
+		sys.exit(1)
+	if "error" in response:
+		sys.stderr.write('error: ' + response["error"] + '\n')
+	if timing and "runTime" in response:
+		sys.stderr.write('queue wait: {0:.3f} s, run time: {1:.3f} s\n'.format(response["queueWait"], response["runTime"]))
+	sys.exit(response["exitCode"])
+
+import atexit
+import signal
+import threading
+import time
+
+import stage_io
+
+# ジョブで使うモジュールとスクリプトを読み込んでおき、子プロセスはそれを引き継ぐ
+import codecs
+import csv
+import datetime
+import hashlib
+import heapq
+import itertools
+import locale
+import math
+import multiprocessing
+import select
+import stat
+
+import column_cache
+import column_reader
+import compressed_io
+import external_sort
+import pipeline
+import rolling
+import run_stats
+import time_index
+try:
+	import numpy
+except ImportError:
+	numpy = None
+for tool in stage_io.toolScripts:
+	stage_io.loadScript(stage_io.scriptPath(tool))
+
+def runChild(script, args, cwd, fds):
+	# 子プロセスで、クライアントの作業ディレクトリと標準入出力を使ってスクリプトを実行する
+	exitCode = 1
+	try:
+		server.close()
+		os.chdir(cwd)
+		for k in range(3):
+			os.dup2(fds[k], k)
+			os.close(fds[k])
+		# 親プロセスの他のスレッドが持っていたロックを引き継がないよう、ファイルオブジェクトを作り直す
+		sys.stdin = open(0, 'r', closefd=False)
+		sys.stdout = open(1, 'w', closefd=False)
+		sys.stderr = open(2, 'w', closefd=False)
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		# ジョブが登録したものだけを終了時に実行する
+		atexit._clear()
+		exitCode = stage_io.runScript(script, stage_io.Stage([script] + args, chained=False))
+		atexit._run_exitfuncs()
+		for f in [sys.stdout, sys.stderr]:
+			if not f.closed:
+				f.flush()
+	except BaseException as e:
+		try:
+			sys.stderr.write('error: ' + str(e) + '\n')
+			sys.stderr.flush()
+		except BaseException:
+			pass
+	finally:
+		os._exit(exitCode)
+
+def watchClient(conn, pid, done):
+	# ジョブの終了前にクライアントが切断した場合 (Ctrl-C など) は、ジョブを終了させる
+	try:
+		conn.recv(1)
+	except OSError:
+		pass
+	if not done.is_set():
+		try:
+			os.kill(pid, signal.SIGTERM)
+		except OSError:
+			pass
+
+jobCount = 0
+jobLock = threading.Lock()
+logLock = threading.Lock()
+slots = threading.Semaphore(jobs)
+
+def handleJob(conn, accepted):
+	global jobCount
+	fds = []
+	try:
+		data, fds, flags, address = socket.recv_fds(conn, maxMessage, 3)
+		request = receiveLine(conn, data)
+		if len(fds) != 3:
+			raise Exception("standard input, output and error must be passed")
+		args = request["argv"]
+		if len(args) == 0 or args[0] not in stage_io.toolScripts:
+			raise Exception("unknown tool " + (args[0] if len(args) > 0 else ""))
+		script = stage_io.scriptPath(args[0])
+		with jobLock:
+			jobCount += 1
+			jobNo = jobCount
+		slots.acquire()
+		try:
+			started = time.perf_counter()
+			pid = os.fork()
+			if pid == 0:
+				runChild(script, args[1:], request["cwd"], fds)
+			for fd in fds:
+				os.close(fd)
+			fds = []
+			done = threading.Event()
+			threading.Thread(target=watchClient, args=(conn, pid, done), daemon=True).start()
+			status = os.waitpid(pid, 0)[1]
+			done.set()
+			finished = time.perf_counter()
+		finally:
+			slots.release()
+		exitCode = os.waitstatus_to_exitcode(status)
+		if exitCode < 0:
+			exitCode = 128 - exitCode
+		queueWait = started - accepted
+		runTime = finished - started
+		with logLock:
+			sys.stderr.write('job {0}: {1} exit {2}, queue wait {3:.3f} s, run time {4:.3f} s\n'.format(
+				jobNo, ' '.join(args), exitCode, queueWait, runTime))
+		response = {"exitCode": exitCode, "queueWait": queueWait, "runTime": runTime}
+	except Exception as e:
+		response = {"exitCode": 1, "error": str(e)}
+	finally:
+		for fd in fds:
+			os.close(fd)
+	try:
+		conn.sendall((json.dumps(response) + '\n').encode('utf-8'))
+		conn.shutdown(socket.SHUT_RDWR)
+	except OSError:
+		pass
+	conn.close()
+
+def prepareSocket(path):
+	# 前回のデーモンが残したソケットは取り除き、動いているデーモンがあればエラーとする
+	if not os.path.exists(path):
+		return
+	probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		probe.connect(path)
+	except OSError:
+		os.remove(path)
+		return
+	finally:
+		probe.close()
+	raise Exception("daemon already running on " + path)
+
+try:
+	prepareSocket(socketPath)
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	server.bind(socketPath)
+	os.chmod(socketPath, 0o600)
+	server.listen(64)
+except Exception as e:
+	sys.stderr.write('error: ' + str(e) + '\n')
+	sys.exit(1)
+
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+sys.stderr.write('listening on {0} ({1} jobs)\n'.format(socketPath, jobs))
+try:
+	while True:
+		conn, address = server.accept()
+		threading.Thread(target=handleJob, args=(conn, time.perf_counter()), daemon=True).start()
+except KeyboardInterrupt:
+	pass
+finally:
+	server.close()
+	os.remove(socketPath)
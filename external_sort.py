@@ -0,0 +1,192 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# 指定した列の値で行を並べ替える (値が等しい行は入力の順序を保つ)
+# メモリ量の目安を超える入力は、並べ替えた部分 (ラン) を一時ファイルに書き出し、最後に k-way マージする
+# ランの並べ替えと、ランが多い場合の途中のマージは、複数のプロセスで並列に行う
+
+import datetime
+import heapq
+import multiprocessing
+import operator
+import os
+import pickle
+import shutil
+import tempfile
+
+keyTypes = ["str", "num", "date"]
+# 一度にマージするランの最大数 (これより多い場合は、いくつかずつまとめてから最後にマージする)
+mergeWidth = 64
+# ランのファイルに一度に書き出す行数
+runBatchRows = 4096
+
+def parseNumber(inStr):
+	# chain.py の前の段から受け取った値は、解析済みの数値の場合がある
+	if type(inStr) is not str:
+		return inStr
+	try:
+		return int(inStr)
+	except ValueError:
+		return float(inStr)
+
+def makeKeys(rows, column, keyType, dateFormat, firstRecord):
+	# 各行の並べ替えに使う値のリストを返す (firstRecord はエラー表示用の最初の行の番号)
+	keys = []
+	for row in rows:
+		try:
+			value = row[column]
+			if keyType == "str":
+				value = str(value)
+			elif keyType == "num":
+				value = parseNumber(value)
+			elif keyType == "date":
+				value = datetime.datetime.strptime(value, dateFormat)
+		except (ValueError, IndexError) as e:
+			raise Exception("record {0}: invalid key: {1}".format(firstRecord + len(keys), e))
+		keys.append(value)
+	return keys
+
+def sortPairs(rows, column, keyType, dateFormat, descending, firstRecord):
+	# Python の並べ替えは reverse=True でも安定なため、降順でも等しい行の順序は保たれる
+	pairs = list(zip(makeKeys(rows, column, keyType, dateFormat, firstRecord), rows))
+	pairs.sort(key=operator.itemgetter(0), reverse=descending)
+	return pairs
+
+def writeRun(pairs, tempDir):
+	fd, fileName = tempfile.mkstemp(suffix=".run", dir=tempDir)
+	with os.fdopen(fd, 'wb') as f:
+		for i in range(0, len(pairs), runBatchRows):
+			pickle.dump(pairs[i:i + runBatchRows], f, pickle.HIGHEST_PROTOCOL)
+	return fileName
+
+def readRun(fileName):
+	with open(fileName, 'rb') as f:
+		while True:
+			try:
+				pairs = pickle.load(f)
+			except EOFError:
+				return
+			yield from pairs
+
+def mergePairs(fileNames, descending):
+	# heapq.merge は値が等しい場合に先のランの行を先に返すため、マージも安定になる
+	return heapq.merge(*[readRun(x) for x in fileNames], key=operator.itemgetter(0), reverse=descending)
+
+def sortRun(args):
+	rows, column, keyType, dateFormat, descending, firstRecord, tempDir = args
+	return writeRun(sortPairs(rows, column, keyType, dateFormat, descending, firstRecord), tempDir)
+
+def mergeRun(args):
+	fileNames, descending, tempDir = args
+	fd, fileName = tempfile.mkstemp(suffix=".run", dir=tempDir)
+	with os.fdopen(fd, 'wb') as f:
+		batch = []
+		for pair in mergePairs(fileNames, descending):
+			batch.append(pair)
+			if len(batch) >= runBatchRows:
+				pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+				batch = []
+		if len(batch) > 0:
+			pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+	for x in fileNames:
+		os.remove(x)
+	return fileName
+
+def rowSize(row):
+	# 行が使うメモリ量のおおよその見積もり (リストと各文字列・数値のオブジェクトの大きさ)
+	return 56 + sum(57 + len(x) if type(x) is str else 40 for x in row)
+
+class ExternalSorter:
+	def __init__(self, column, keyType, dateFormat, descending, memoryBytes, jobs, tempDir=None):
+		self.column = column
+		self.keyType = keyType
+		self.dateFormat = dateFormat
+		self.descending = descending
+		self.jobs = jobs
+		# 並列に処理する場合は、読み込み中の行と各プロセスに渡した行がメモリ量の目安に収まるようにする
+		self.chunkBytes = memoryBytes // (jobs + 1) if jobs > 1 else memoryBytes
+		self.tempDirBase = tempDir
+		self.tempDir = None
+		self.pool = None
+		self.pending = []
+		self.pendingBytes = 0
+		self.records = 0
+		# 各ランのファイル名 (並列処理中のものは AsyncResult)
+		self.runs = []
+
+	def add(self, row):
+		self.pending.append(row)
+		self.pendingBytes += rowSize(row)
+		if self.pendingBytes >= self.chunkBytes:
+			self.spill()
+
+	def getPool(self):
+		if self.pool is None:
+			self.pool = multiprocessing.get_context('fork').Pool(self.jobs)
+		return self.pool
+
+	def spill(self):
+		if self.tempDir is None:
+			self.tempDir = tempfile.mkdtemp(prefix="sort-", dir=self.tempDirBase)
+		args = (self.pending, self.column, self.keyType, self.dateFormat, self.descending, self.records + 1, self.tempDir)
+		if self.jobs > 1:
+			# 先に渡したものの完了を待ち、同時に処理する数をプロセス数までにする
+			inFlight = [x for x in self.runs if not isinstance(x, str)]
+			if len(inFlight) >= self.jobs:
+				self.runs[self.runs.index(inFlight[0])] = inFlight[0].get()
+			self.runs.append(self.getPool().apply_async(sortRun, (args,)))
+		else:
+			self.runs.append(sortRun(args))
+		self.records += len(self.pending)
+		self.pending = []
+		self.pendingBytes = 0
+
+	def sortedRows(self):
+		if len(self.runs) == 0:
+			# 全体がメモリに収まる場合は一時ファイルを使わない
+			for key, row in sortPairs(self.pending, self.column, self.keyType, self.dateFormat, self.descending, self.records + 1):
+				yield row
+			return
+		if len(self.pending) > 0:
+			self.spill()
+		runs = [x if isinstance(x, str) else x.get() for x in self.runs]
+		while len(runs) > mergeWidth:
+			groups = [(runs[i:i + mergeWidth], self.descending, self.tempDir) for i in range(0, len(runs), mergeWidth)]
+			if self.jobs > 1:
+				runs = self.getPool().map(mergeRun, groups)
+			else:
+				runs = [mergeRun(x) for x in groups]
+		for key, row in mergePairs(runs, self.descending):
+			yield row
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
+		if self.tempDir is not None:
+			shutil.rmtree(self.tempDir, ignore_errors=True)
+			self.tempDir = None
@@ -0,0 +1,150 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# --pipelined 指定時に、読み込みと書き込みを別のスレッドで行い、計算と並行して進める
+# スレッドとの間は行のまとまりを上限のあるキューで受け渡すため、使用メモリ量はキューの長さで抑えられる
+
+import atexit
+import itertools
+import queue
+import threading
+
+# 読み込みは、1回におよそこのバイト数の行をまとめて読む
+readSize = 1024 * 1024
+# 書き込みは、この行数ごとにまとめて書き出す
+writeRows = 4096
+# キューに置けるまとまりの数
+queueDepth = 4
+
+class ReadAhead:
+	# readBatch を繰り返し呼んで、空のリストが返るまで要素のまとまりを読み込むスレッド
+	def __init__(self, readBatch):
+		self.readBatch = readBatch
+		self.batches = queue.Queue(queueDepth)
+		self.stopped = False
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		atexit.register(self.stop)
+
+	def run(self):
+		try:
+			while not self.stopped:
+				items = self.readBatch()
+				self.batches.put(items)
+				if len(items) == 0:
+					break
+		except Exception as e:
+			self.batches.put(e)
+
+	def stop(self):
+		# 読み込みを途中でやめる場合は、スレッドが待たずに終われるよう取り出しておく
+		self.stopped = True
+		while self.thread.is_alive():
+			try:
+				self.batches.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		atexit.unregister(self.stop)
+
+def runAhead(readBatch):
+	# readBatch で読み込んだ要素を、別のスレッドで先読みしながら返す
+	# スレッドは最初の要素を取り出すときに開始する
+	reader = ReadAhead(readBatch)
+	try:
+		while True:
+			items = reader.batches.get()
+			if isinstance(items, Exception):
+				raise items
+			if len(items) == 0:
+				break
+			yield from items
+	finally:
+		reader.stop()
+
+def readAhead(f):
+	# f (テキストまたはバイナリモードのファイル) の行を、別のスレッドで先読みしながら返す
+	return runAhead(lambda: f.readlines(readSize))
+
+def iterateAhead(iterable):
+	# iterable の要素 (解析した入力など) を、別のスレッドで先に取り出しながら返す
+	it = iter(iterable)
+	return runAhead(lambda: list(itertools.islice(it, writeRows)))
+
+class PipelinedWriter:
+	# 書き込む行をまとめ、別のスレッドで writeBatch (csv.writer の writerows など) に渡す
+	def __init__(self, writeBatch):
+		self.writeBatch = writeBatch
+		self.pending = []
+		self.batches = queue.Queue(queueDepth)
+		self.error = None
+		self.closed = False
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		# エラーで終了する場合も、それまでの行を書き出してからスレッドを止める
+		atexit.register(self.close)
+
+	def run(self):
+		while True:
+			rows = self.batches.get()
+			if rows is None:
+				break
+			if self.error is not None:
+				continue
+			try:
+				self.writeBatch(rows)
+			except Exception as e:
+				self.error = e
+
+	def writerow(self, row):
+		self.pending.append(row)
+		if len(self.pending) >= writeRows:
+			self.flush()
+
+	def writerows(self, rows):
+		self.pending.extend(rows)
+		if len(self.pending) >= writeRows:
+			self.flush()
+
+	def flush(self):
+		if self.error is not None:
+			raise self.error
+		if len(self.pending) > 0:
+			self.batches.put(self.pending)
+			self.pending = []
+
+	def close(self):
+		# 残りの行を書き出し、書き込みが終わるまで待つ
+		if self.closed:
+			return
+		self.closed = True
+		if len(self.pending) > 0:
+			self.batches.put(self.pending)
+			self.pending = []
+		self.batches.put(None)
+		self.thread.join()
+		atexit.unregister(self.close)
+		if self.error is not None:
+			raise self.error
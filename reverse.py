@@ -34,25 +34,81 @@ options:
   -o <file> / --output-file <file> : 出力ファイル名を設定 (省略時標準出力)
   --input-encode <encode>          : 入力文字コードを設定 (省略時システム標準)
   --output-encode <encode>         : 出力文字コードを設定 (省略時システム標準)
+  --compress-level <num>           : 圧縮して出力する場合の圧縮レベルを設定 (0～9、省略時 gzip / xz は6、bzip2 は9)
+    入力ファイルが gzip / bzip2 / xz で圧縮されている場合は、別のスレッドで展開しながら読み込む。
+    出力ファイル名の拡張子が .gz / .bz2 / .xz の場合は、別のスレッドで圧縮しながら書き出す。
 
   --header <num>                   : ヘッダ行数を設定 (省略時0)
 
-ファイル名・文字コード・ヘッダ行数は、それぞれ0回か1回のみ設定可能。
+  --block-size <bytes>             : 省メモリモードで処理し、読み込み単位を設定
+    入力を行に分解せず、ファイルの末尾からブロック単位で読み込んで
+    各行のバイト列をそのまま逆順に出力する。
+    使用メモリ量はファイルサイズではなくブロックサイズで抑えられる。
+    ただし、" で始まらない列の途中に " があり、後ろから行の区切りを判定できない場合は、通常の方法で処理する。
+    入力ファイル名の指定が必要。
+    入力文字コードは ASCII 互換 (UTF-8, Shift_JIS など) である必要がある。
+
+  -k <col-num> / --key <col-num>   : 逆順にする代わりに、指定した列の値で行を並べ替える
+  --key-type <type>                : 並べ替えに使う値の種類を設定 (省略時str)
+    type: str (文字列) / num (数値) / date (日時)
+  --key-date <format>              : --key-type date の日時の形式を設定 (省略時 %Y/%m/%d %H:%M:%S )
+  --descending                     : 降順に並べ替える
+    値が等しい行は、昇順・降順ともに入力の順序を保つ。
+  --memory <MB>                    : 並べ替えに使うメモリ量の目安を設定 (省略時256)
+    入力がこれを超える場合は、並べ替えた部分を一時ファイルに書き出し、最後にまとめて出力する。
+  --temp-dir <dir>                 : 一時ファイルを作るディレクトリを設定 (省略時システム標準)
+  -j <num> / --jobs <num>          : 並べ替えと一時ファイルのまとめを指定した数のプロセスで並列に行う (省略時1)
+    -k / --key 指定時のみ有効。--block-size とは同時に指定できない。
+
+  --pipelined                      : 読み込みと書き込みを別のスレッドで行い、処理と並行して進める
+    --block-size 指定時は、書き込みのみを別のスレッドで行う。
+  --stats                          : 処理にかかった時間や件数などを標準エラー出力に表示する
+    読み込み (--block-size 指定時はヘッダの読み込み)・書き込みの各段階の時間と、
+    ピーク時の使用メモリ量などを表示する。
+  --stats-file <file>              : --stats の結果を JSON 形式でファイルに保存する
+  --stats-sample <ms>              : --stats の結果に、指定した間隔 (CPU 時間) で記録した実行中の箇所を加える
+
+ファイル名・文字コード・圧縮レベル・ヘッダ行数・ブロックサイズ・並べ替えの各設定・--stats-file・--stats-sample は、それぞれ0回か1回のみ設定可能。
+列の指定は一番左の列を1列目とする。
 """.strip()
 
 import sys
 import codecs
 import csv
+import locale
+
+import column_reader
+import compressed_io
+import external_sort
+import pipeline
+import run_stats
+import stage_io
 
 inputFileName = None
 outputFileName = None
 inputEncode = None
 outputEncode = None
 headerNum = None
+blockSize = None
+statsEnabled = False
+statsFileName = None
+statsSample = None
+compressLevel = None
+pipelined = False
+keyColumn = None
+keyType = None
+keyDateFormat = None
+descending = False
+memoryLimit = None
+tempDir = None
+jobs = None
+
+# chain.py の段として動く場合は、その段のオプションと前後の段との受け渡しを使う
+stage = stage_io.current()
 
 i = 1
-argc = len(sys.argv)
-argv = sys.argv
+argv = sys.argv if stage is None else stage.argv
+argc = len(argv)
 try:
 	while i < argc:
 		if argv[i] == '-h' or argv[i] == '--help':
@@ -95,33 +151,329 @@ try:
 			headerNum = int(argv[i])
 			if headerNum < 0:
 				raise Exception("header count must be non-negative")
+		elif argv[i] == '--block-size':
+			if blockSize is not None:
+				raise Exception("multiple --block-size")
+			if i + 1 >= argc:
+				raise Exception("missing block size")
+			i += 1
+			blockSize = int(argv[i])
+			if blockSize <= 0:
+				raise Exception("block size must be positive")
+		elif argv[i] == '--compress-level':
+			if compressLevel is not None:
+				raise Exception("multiple --compress-level")
+			if i + 1 >= argc:
+				raise Exception("missing compression level")
+			i += 1
+			compressLevel = int(argv[i])
+			if compressLevel < 0 or 9 < compressLevel:
+				raise Exception("compression level must be between 0 and 9")
+		elif argv[i] == '-k' or argv[i] == '--key':
+			if keyColumn is not None:
+				raise Exception("multiple -k or --key")
+			if i + 1 >= argc:
+				raise Exception("missing key column")
+			i += 1
+			keyColumn = int(argv[i])
+			if keyColumn <= 0:
+				raise Exception("column number must be positive")
+			keyColumn -= 1
+		elif argv[i] == '--key-type':
+			if keyType is not None:
+				raise Exception("multiple --key-type")
+			if i + 1 >= argc:
+				raise Exception("missing key type")
+			i += 1
+			keyType = argv[i]
+			if keyType not in external_sort.keyTypes:
+				raise Exception("unknown key type " + keyType)
+		elif argv[i] == '--key-date':
+			if keyDateFormat is not None:
+				raise Exception("multiple --key-date")
+			if i + 1 >= argc:
+				raise Exception("missing key date format")
+			i += 1
+			keyDateFormat = argv[i]
+		elif argv[i] == '--descending':
+			descending = True
+		elif argv[i] == '--memory':
+			if memoryLimit is not None:
+				raise Exception("multiple --memory")
+			if i + 1 >= argc:
+				raise Exception("missing memory size")
+			i += 1
+			memoryLimit = float(argv[i])
+			if memoryLimit <= 0:
+				raise Exception("memory size must be positive")
+		elif argv[i] == '--temp-dir':
+			if tempDir is not None:
+				raise Exception("multiple --temp-dir")
+			if i + 1 >= argc:
+				raise Exception("missing temporary directory")
+			i += 1
+			tempDir = argv[i]
+		elif argv[i] == '-j' or argv[i] == '--jobs':
+			if jobs is not None:
+				raise Exception("multiple -j or --jobs")
+			if i + 1 >= argc:
+				raise Exception("missing number of jobs")
+			i += 1
+			jobs = int(argv[i])
+			if jobs <= 0:
+				raise Exception("number of jobs must be positive")
+		elif argv[i] == '--pipelined':
+			pipelined = True
+		elif argv[i] == '--stats':
+			statsEnabled = True
+		elif argv[i] == '--stats-file':
+			if statsFileName is not None:
+				raise Exception("multiple --stats-file")
+			if i + 1 >= argc:
+				raise Exception("missing stats file name")
+			i += 1
+			statsFileName = argv[i]
+			statsEnabled = True
+		elif argv[i] == '--stats-sample':
+			if statsSample is not None:
+				raise Exception("multiple --stats-sample")
+			if i + 1 >= argc:
+				raise Exception("missing sampling interval")
+			i += 1
+			statsSample = float(argv[i])
+			if statsSample <= 0:
+				raise Exception("sampling interval must be positive")
+			statsEnabled = True
 		else:
 			raise Exception("unknown option " + argv[i])
 		i += 1
+	if keyColumn is None and (keyType is not None or keyDateFormat is not None or descending or memoryLimit is not None or tempDir is not None or jobs is not None):
+		raise Exception("sort options require -k or --key")
+	if keyColumn is not None and blockSize is not None:
+		raise Exception("-k or --key cannot be used with --block-size")
+	stage_io.checkOptions(stage, inputFileName is not None or inputEncode is not None,
+		outputFileName is not None or outputEncode is not None or compressLevel is not None, pipelined, statsSample)
+	if stage is not None and stage.output is not None and blockSize is not None:
+		raise Exception("--block-size cannot be used before the last stage")
+	if keyType is None : keyType = "str"
+	if keyDateFormat is None : keyDateFormat = "%Y/%m/%d %H:%M:%S"
+	if memoryLimit is None : memoryLimit = 256
+	if jobs is None : jobs = 1
+	stats = None
+	if statsEnabled:
+		stats = run_stats.Stats("reverse.py")
+		if statsSample is not None:
+			stats.startSampling(statsSample)
 except Exception as e:
 	sys.stderr.write('error: ' + str(e) + '\n')
 	sys.exit(1)
 
-inputFile = open(inputFileName, 'r', newline='') if inputFileName is not None else sys.stdin
-outputFile = open(outputFileName, 'w', newline='') if outputFileName is not None else sys.stdout
-if outputFileName is None:
-	sys.stdout.reconfigure(newline='')
+def normalizeRecord(record):
+	if record.endswith(b'\r\n'):
+		record = record[:-2]
+	elif record.endswith(b'\n'):
+		record = record[:-1]
+	return record + b'\r\n'
+
+def scanHeader(f, headerNum, blockSize):
+	# ヘッダ行の終端位置のリスト・ファイル全体の " の数・ファイルサイズと、
+	# 後ろから " の数の偶奇で行の区切りを判定できるかを返す
+	# 行の区切りは column_reader と同様に、列の先頭の " で始まる列の外にある改行とし、
+	# 列の途中の " があって各改行の前の " の数の偶奇と一致しない場合は、偶奇では判定できないとする
+	headerEnds = []
+	quoteCount = 0
+	inQuotes = False
+	consistent = True
+	offset = 0
+	rest = b''
+	while True:
+		block = f.read(blockSize)
+		if len(block) == 0:
+			break
+		data = rest + block
+		base = offset - len(rest)
+		offset += len(block)
+		last = data.rfind(b'\n') + 1
+		rest = data[last:]
+		if not inQuotes and data.find(b'"', 0, last) < 0 and len(headerEnds) >= headerNum:
+			continue
+		start = 0
+		while start < last:
+			lineEnd = data.find(b'\n', start) + 1
+			count = data.count(b'"', start, lineEnd)
+			if inQuotes or count > 0:
+				quoteCount += count
+				inQuotes = column_reader.endsInQuotes(data[start:lineEnd], b',', b'"', inQuotes)
+				if inQuotes != (quoteCount % 2 != 0):
+					consistent = False
+			if not inQuotes and len(headerEnds) < headerNum:
+				headerEnds.append(base + lineEnd)
+			start = lineEnd
+	quoteCount += rest.count(b'"')
+	if len(headerEnds) < headerNum and offset > (headerEnds[-1] if len(headerEnds) > 0 else 0):
+		headerEnds.append(offset)
+	return headerEnds, quoteCount, offset, consistent
+
+def writeReversedRecords(f, writeRecord, begin, end, quoteCount, blockSize):
+	# quoteCount はファイル先頭から end までの " の数
+	tail = b''
+	atFileEnd = True
+	pos = end
+	while pos > begin:
+		readSize = min(blockSize, pos - begin)
+		pos -= readSize
+		f.seek(pos)
+		block = f.read(readSize)
+		data = block + tail
+		recordEnd = len(data)
+		scanEnd = len(block)
+		while True:
+			nl = block.rfind(b'\n', 0, scanEnd)
+			if nl < 0:
+				break
+			quoteCount -= data.count(b'"', nl + 1, scanEnd)
+			scanEnd = nl
+			if quoteCount % 2 == 0:
+				if not atFileEnd or recordEnd > nl + 1:
+					writeRecord(data[nl + 1:recordEnd])
+				atFileEnd = False
+				recordEnd = nl + 1
+		quoteCount -= data.count(b'"', 0, scanEnd)
+		tail = data[:recordEnd]
+	if len(tail) > 0:
+		writeRecord(tail)
+
+if blockSize is not None:
+	if inputFileName is None:
+		sys.stderr.write("error: --block-size requires -i or --input-file\n")
+		sys.exit(1)
+	if compressed_io.inputCompression(inputFileName) is not None:
+		sys.stderr.write("error: compressed input cannot be used with --block-size\n")
+		sys.exit(1)
+	inputCode = inputEncode if inputEncode is not None else locale.getpreferredencoding(False)
+	outputCode = outputEncode if outputEncode is not None else locale.getpreferredencoding(False)
+	try:
+		if '"\n'.encode(inputCode) != b'"\n':
+			raise LookupError()
+	except LookupError:
+		sys.stderr.write("error: input encoding not supported with --block-size\n")
+		sys.exit(1)
+	convert = codecs.lookup(inputCode).name != codecs.lookup(outputCode).name
+
+	if stats is not None:
+		scanHeader = stats.timeFunction("scan", scanHeader)
+	inputFile = open(inputFileName, 'rb')
+	headerEnds, quoteCount, fileSize, consistent = scanHeader(inputFile, headerNum if headerNum is not None else 0, blockSize)
+	if not consistent:
+		# 列の途中の " のために後ろから行の区切りを判定できないため、--block-size を使わずに csv モジュールで読む
+		inputFile.close()
+		blockSize = None
+
+if blockSize is not None:
+	outputFile = compressed_io.openOutput(outputFileName, compressLevel) if outputFileName is not None else sys.stdout.buffer
 
-inputFileReader = codecs.getreader(inputEncode)(inputFile) if inputEncode is not None else inputFile
-outputFileWriter = codecs.getwriter(outputEncode)(outputFile) if outputEncode is not None else outputFile
+	writeOutput = outputFile.write
+	pipelineWriter = None
+	if pipelined:
+		pipelineWriter = pipeline.PipelinedWriter(lambda records: outputFile.write(b''.join(records)))
+		writeOutput = pipelineWriter.writerow
 
-csvReader = csv.reader(inputFileReader)
-csvWriter = csv.writer(outputFileWriter)
+	def writeRecord(record):
+		record = normalizeRecord(record)
+		if convert:
+			record = record.decode(inputCode).encode(outputCode)
+		writeOutput(record)
+
+	if stats is not None:
+		writeRecord = stats.timeFunction("write", writeRecord)
+
+	if quoteCount % 2 != 0:
+		sys.stderr.write("error: unterminated quoted field\n")
+		sys.exit(1)
+	prevEnd = 0
+	for headerEnd in headerEnds:
+		inputFile.seek(prevEnd)
+		writeRecord(inputFile.read(headerEnd - prevEnd))
+		prevEnd = headerEnd
+	writeReversedRecords(inputFile, writeRecord, prevEnd, fileSize, quoteCount, blockSize)
+	if pipelineWriter is not None:
+		pipelineWriter.close()
+
+	if stats is not None:
+		stats.rowsRead = stats.stage("write")[1]
+		stats.rowsWritten = stats.stage("write")[1]
+		stats.bytesRead = fileSize
+		stats.bytesWritten = run_stats.streamPosition(outputFile)
+		stats.report(statsFileName)
+
+	inputFile.close()
+	outputFile.close()
+	sys.exit(0)
+
+inputFile = None
+outputFile = None
+if stage is not None and stage.input is not None:
+	csvReader = stage.input.rows()
+else:
+	inputFile = compressed_io.openTextInput(inputFileName, inputEncode) if inputFileName is not None else sys.stdin
+	if inputFileName is None and inputEncode is not None:
+		sys.stdin.reconfigure(encoding=inputEncode)
+	csvReader = csv.reader(inputFile if not pipelined else pipeline.readAhead(inputFile))
+if stage is not None and stage.output is not None:
+	csvWriter = stage.output
+else:
+	outputFile = compressed_io.openTextOutput(outputFileName, outputEncode, compressLevel) if outputFileName is not None else sys.stdout
+	if outputFileName is None:
+		sys.stdout.reconfigure(newline='', encoding=outputEncode)
+	csvWriter = csv.writer(outputFile)
+pipelineWriter = None
+if pipelined:
+	pipelineWriter = pipeline.PipelinedWriter(csvWriter.writerows)
+	csvWriter = pipelineWriter
+if stats is not None:
+	csvReader = stats.timeIterator("read", csvReader)
+	csvWriter = stats.timeWriter("write", csvWriter)
 
 lineNo = 0
-bufferedRows = []
-for row in csvReader:
-	lineNo += 1
-	if headerNum is not None and lineNo <= headerNum:
-		csvWriter.writerow(row)
-	else:
-		bufferedRows.append(row)
-
-bufferSize = len(bufferedRows)
-for i in range(bufferSize):
-	csvWriter.writerow(bufferedRows[bufferSize - 1 - i])
+if keyColumn is not None:
+	sorter = external_sort.ExternalSorter(keyColumn, keyType, keyDateFormat, descending, int(memoryLimit * 1024 * 1024), jobs, tempDir)
+	try:
+		for row in csvReader:
+			lineNo += 1
+			if headerNum is not None and lineNo <= headerNum:
+				csvWriter.writerow(row)
+			else:
+				sorter.add(row)
+		for row in sorter.sortedRows():
+			csvWriter.writerow(row)
+	except Exception as e:
+		sys.stderr.write('error: ' + str(e) + '\n')
+		sys.exit(1)
+	finally:
+		sorter.close()
+else:
+	bufferedRows = []
+	for row in csvReader:
+		lineNo += 1
+		if headerNum is not None and lineNo <= headerNum:
+			csvWriter.writerow(row)
+		else:
+			bufferedRows.append(row)
+
+	bufferSize = len(bufferedRows)
+	for i in range(bufferSize):
+		csvWriter.writerow(bufferedRows[bufferSize - 1 - i])
+if pipelineWriter is not None:
+	pipelineWriter.close()
+
+if stats is not None:
+	stats.rowsRead = lineNo
+	stats.rowsWritten = lineNo
+	stats.bytesRead = run_stats.streamPosition(inputFile)
+	stats.bytesWritten = run_stats.streamPosition(outputFile)
+	stats.report(statsFileName)
+
+if inputFile is not None:
+	inputFile.close()
+if outputFile is not None:
+	outputFile.close()
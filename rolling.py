@@ -0,0 +1,146 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# 直近 width 個の値に対する移動最小値・移動最大値・移動標準偏差・移動中央値
+# 各クラスの push は値を1個加え、窓が埋まっていればその時点の結果を、埋まっていなければ None を返す
+
+import collections
+import heapq
+import math
+
+class RollingExtreme:
+	# 単調なキュー: 窓内で、後から来た値に上書きされない候補だけを (番号, 値) で持つ
+	def __init__(self, width, isMax):
+		self.width = width
+		self.isMax = isMax
+		self.queue = collections.deque()
+		self.count = 0
+
+	def push(self, v):
+		queue = self.queue
+		if self.isMax:
+			while len(queue) > 0 and queue[-1][1] <= v:
+				queue.pop()
+		else:
+			while len(queue) > 0 and queue[-1][1] >= v:
+				queue.pop()
+		queue.append((self.count, v))
+		self.count += 1
+		if queue[0][0] <= self.count - 1 - self.width:
+			queue.popleft()
+		return queue[0][1] if self.count >= self.width else None
+
+def RollingMin(width):
+	return RollingExtreme(width, False)
+
+def RollingMax(width):
+	return RollingExtreme(width, True)
+
+class RollingStd:
+	# Welford 法の更新を、窓から出る値の削除と組み合わせて行う (標本標準偏差)
+	def __init__(self, width):
+		self.width = width
+		self.window = [0.0] * width
+		self.pos = 0
+		self.count = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+
+	def push(self, v):
+		v = float(v)
+		if self.count < self.width:
+			self.count += 1
+			delta = v - self.mean
+			self.mean += delta / self.count
+			self.m2 += delta * (v - self.mean)
+		else:
+			old = self.window[self.pos]
+			prevMean = self.mean
+			self.mean += (v - old) / self.width
+			self.m2 += (v - old) * (v - self.mean + old - prevMean)
+		self.window[self.pos] = v
+		self.pos += 1
+		if self.pos >= self.width:
+			self.pos = 0
+			# 誤差が蓄積しないよう、一周ごとに計算し直す
+			if self.count >= self.width:
+				self.mean = math.fsum(self.window) / self.width
+				self.m2 = math.fsum((x - self.mean) ** 2 for x in self.window)
+		if self.count < self.width:
+			return None
+		return math.sqrt(max(self.m2, 0.0) / (self.width - 1))
+
+class RollingMedian:
+	# 小さい側の半分 (符号を反転した最大ヒープ) と大きい側の半分 (最小ヒープ) に分けて持つ
+	# 窓から出た値は削除予定として数え、ヒープの先頭に来たときに取り除く
+	def __init__(self, width):
+		self.width = width
+		self.window = collections.deque()
+		self.low = []
+		self.high = []
+		self.lowSize = 0
+		self.highSize = 0
+		self.delayed = collections.Counter()
+
+	def prune(self, heap, sign):
+		while len(heap) > 0 and self.delayed[heap[0] * sign] > 0:
+			self.delayed[heapq.heappop(heap) * sign] -= 1
+
+	def rebalance(self):
+		if self.lowSize > self.highSize + 1:
+			heapq.heappush(self.high, -heapq.heappop(self.low))
+			self.lowSize -= 1
+			self.highSize += 1
+		elif self.lowSize < self.highSize:
+			heapq.heappush(self.low, -heapq.heappop(self.high))
+			self.lowSize += 1
+			self.highSize -= 1
+		self.prune(self.low, -1)
+		self.prune(self.high, 1)
+
+	def push(self, v):
+		if self.lowSize == 0 or v <= -self.low[0]:
+			heapq.heappush(self.low, -v)
+			self.lowSize += 1
+		else:
+			heapq.heappush(self.high, v)
+			self.highSize += 1
+		self.window.append(v)
+		if len(self.window) > self.width:
+			old = self.window.popleft()
+			self.delayed[old] += 1
+			if old <= -self.low[0]:
+				self.lowSize -= 1
+				self.prune(self.low, -1)
+			else:
+				self.highSize -= 1
+				self.prune(self.high, 1)
+		self.rebalance()
+		if len(self.window) < self.width:
+			return None
+		if self.width % 2 == 1:
+			return -self.low[0]
+		return (-self.low[0] + self.high[0]) / 2
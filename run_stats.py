@@ -0,0 +1,210 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# --stats 指定時に、処理の各段階にかかった時間や件数を集計して表示する
+# 計測は、計測したい関数やイテレータを包んだものに差し替えて行うため、指定しない場合は何もしない
+
+import json
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+try:
+	import signal
+except ImportError:
+	signal = None
+
+class Stats:
+	def __init__(self, toolName):
+		self.toolName = toolName
+		self.startTime = time.perf_counter()
+		# 段階名 -> [合計時間, 呼び出し回数]
+		self.stages = {}
+		self.counters = {}
+		self.rowsRead = None
+		self.rowsWritten = None
+		self.bytesRead = None
+		self.bytesWritten = None
+		self.samples = None
+		self.sampleCount = 0
+
+	def stage(self, name):
+		if name not in self.stages:
+			self.stages[name] = [0.0, 0]
+		return self.stages[name]
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def timeFunction(self, name, function):
+		stage = self.stage(name)
+		perfCounter = time.perf_counter
+		def timed(*args):
+			begin = perfCounter()
+			result = function(*args)
+			stage[0] += perfCounter() - begin
+			stage[1] += 1
+			return result
+		return timed
+
+	def countCalls(self, name, function):
+		counters = self.counters
+		counters.setdefault(name, 0)
+		def counted(*args):
+			counters[name] += 1
+			return function(*args)
+		return counted
+
+	def timeIterator(self, name, iterator):
+		# 次の要素を取り出すのにかかった時間を計測する
+		stage = self.stage(name)
+		perfCounter = time.perf_counter
+		iterator = iter(iterator)
+		while True:
+			begin = perfCounter()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				stage[0] += perfCounter() - begin
+				return
+			stage[0] += perfCounter() - begin
+			stage[1] += 1
+			yield item
+
+	def timeWriter(self, name, csvWriter):
+		return TimedWriter(self, name, csvWriter)
+
+	def startSampling(self, interval):
+		# interval ミリ秒の CPU 時間ごとに、実行中の行と関数を記録する
+		if signal is None or not hasattr(signal, "setitimer"):
+			raise Exception("sampling profiler is not supported on this platform")
+		self.samples = {"lines": {}, "functions": {}}
+		lines = self.samples["lines"]
+		functions = self.samples["functions"]
+		def sample(signum, frame):
+			self.sampleCount += 1
+			# このモジュールの計測用の関数は飛ばす
+			while frame is not None and frame.f_code.co_filename == __file__:
+				frame = frame.f_back
+			if frame is None:
+				return
+			line = "{0}:{1} ({2})".format(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+			lines[line] = lines.get(line, 0) + 1
+			seen = set()
+			while frame is not None:
+				function = "{0}:{1}".format(frame.f_code.co_filename, frame.f_code.co_name)
+				if frame.f_code.co_filename != __file__ and function not in seen:
+					seen.add(function)
+					functions[function] = functions.get(function, 0) + 1
+				frame = frame.f_back
+		signal.signal(signal.SIGPROF, sample)
+		signal.setitimer(signal.ITIMER_PROF, interval / 1000, interval / 1000)
+
+	def stopSampling(self):
+		if self.samples is not None:
+			signal.setitimer(signal.ITIMER_PROF, 0, 0)
+
+	def result(self):
+		elapsed = time.perf_counter() - self.startTime
+		peakRss = None
+		if resource is not None:
+			# Linux では KiB 単位
+			peakRss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+		ret = {
+			"tool": self.toolName,
+			"elapsed": elapsed,
+			"rowsRead": self.rowsRead,
+			"rowsWritten": self.rowsWritten,
+			"rowsPerSec": self.rowsRead / elapsed if self.rowsRead is not None and elapsed > 0 else None,
+			"bytesRead": self.bytesRead,
+			"bytesWritten": self.bytesWritten,
+			"peakRssKiB": peakRss,
+			"stages": {name: {"seconds": stage[0], "calls": stage[1]} for name, stage in self.stages.items()},
+			"otherSeconds": elapsed - sum(stage[0] for stage in self.stages.values()),
+			"counters": self.counters,
+		}
+		if self.samples is not None:
+			ret["samples"] = {
+				"total": self.sampleCount,
+				"lines": sorted(self.samples["lines"].items(), key=lambda x: -x[1])[:20],
+				"functions": sorted(self.samples["functions"].items(), key=lambda x: -x[1])[:20],
+			}
+		return ret
+
+	def report(self, fileName=None):
+		self.stopSampling()
+		result = self.result()
+		if fileName is not None:
+			with open(fileName, 'w') as f:
+				json.dump(result, f, indent=1)
+			return
+		out = sys.stderr
+		out.write("stats: {0}\n".format(result["tool"]))
+		out.write("  elapsed: {0:.3f} s\n".format(result["elapsed"]))
+		for label, key in [("rows read", "rowsRead"), ("rows written", "rowsWritten"), ("bytes read", "bytesRead"), ("bytes written", "bytesWritten"), ("peak RSS (KiB)", "peakRssKiB")]:
+			if result[key] is not None:
+				out.write("  {0}: {1}\n".format(label, result[key]))
+		if result["rowsPerSec"] is not None:
+			out.write("  rows/sec: {0:.0f}\n".format(result["rowsPerSec"]))
+		for name, stage in result["stages"].items():
+			if stage["calls"] > 0:
+				out.write("  stage {0}: {1:.3f} s ({2} calls)\n".format(name, stage["seconds"], stage["calls"]))
+		out.write("  stage other: {0:.3f} s\n".format(result["otherSeconds"]))
+		for name, value in result["counters"].items():
+			out.write("  counter {0}: {1}\n".format(name, value))
+		if "samples" in result:
+			out.write("  samples: {0}\n".format(result["samples"]["total"]))
+			for line, hits in result["samples"]["lines"]:
+				out.write("    {0:6d} {1}\n".format(hits, line))
+			out.write("  samples by function (including callees):\n")
+			for function, hits in result["samples"]["functions"]:
+				out.write("    {0:6d} {1}\n".format(hits, function))
+
+class TimedWriter:
+	# csv.writer の書き込みにかかった時間を計測し、それ以外はそのまま元の writer に任せる
+	def __init__(self, stats, name, csvWriter):
+		self.csvWriter = csvWriter
+		self.writerow = stats.timeFunction(name, csvWriter.writerow)
+		if hasattr(csvWriter, "writerows"):
+			self.writerows = stats.timeFunction(name, csvWriter.writerows)
+
+	def __getattr__(self, name):
+		return getattr(self.csvWriter, name)
+
+def streamPosition(f):
+	# ファイルの現在位置 (バイト数) を返す (パイプなど位置を取得できない場合は None)
+	try:
+		f.flush()
+		if hasattr(f, "buffer"):
+			f = f.buffer
+			f.flush()
+		return f.tell()
+	except (OSError, ValueError, AttributeError):
+		return None
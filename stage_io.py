@@ -0,0 +1,199 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# chain.py で各ツールを同じプロセス内の段として動かすための、段の設定と段の間の行の受け渡し
+# 段として動かすスクリプトは current() で自分の段の設定を受け取り、
+# 前の段がある場合はその行を入力に、次の段がある場合はその段への受け渡しを出力に使う
+
+import builtins
+import os
+import queue
+import sys
+import threading
+import traceback
+import types
+
+import pipeline
+
+class StageStopped(BaseException):
+	# 次の段が入力を読むのをやめたため、この段の出力が不要になったことを表す
+	# スクリプトのエラー処理 (except Exception) に捕まらないよう、BaseException から派生する
+	pass
+
+class PreviousStageFailed(BaseException):
+	# 前の段が失敗したため、この段も途中までの入力で終わらずに失敗として終わることを表す
+	# エラーは前の段が表示しているため、この段では表示しない
+	pass
+
+class RowChannel:
+	# 前の段が書き込んだ行をまとめ、上限のあるキューで次の段に渡す
+	def __init__(self):
+		self.pending = []
+		self.batches = queue.Queue(pipeline.queueDepth)
+		self.cancelled = False
+
+	def put(self, item):
+		while True:
+			if self.cancelled:
+				raise StageStopped()
+			try:
+				self.batches.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+	def writerow(self, row):
+		self.pending.append(row)
+		if len(self.pending) >= pipeline.writeRows:
+			self.flush()
+
+	def writerows(self, rows):
+		self.pending.extend(rows)
+		if len(self.pending) >= pipeline.writeRows:
+			self.flush()
+
+	def flush(self):
+		if len(self.pending) > 0:
+			self.put(self.pending)
+			self.pending = []
+
+	def close(self, failed=False):
+		# 前の段が失敗した場合は、次の段が途中までの行で正常に終わらないようにする
+		if self.cancelled:
+			return
+		try:
+			if not failed:
+				self.flush()
+			self.put(None if not failed else False)
+		except StageStopped:
+			pass
+
+	def cancel(self):
+		self.cancelled = True
+
+	def rows(self):
+		while True:
+			rows = self.batches.get()
+			if rows is None:
+				return
+			if rows is False:
+				raise PreviousStageFailed()
+			yield from rows
+
+# 段の名前と、それぞれで動かすスクリプト
+toolScripts = {
+	"reverse": "reverse.py",
+	"ma": "copy_add_ma.py",
+	"candle": "candle.py",
+}
+
+def scriptPath(tool):
+	return os.path.join(os.path.dirname(os.path.abspath(__file__)), toolScripts[tool])
+
+# コンパイルしたスクリプトのコード (daemon.py では事前に読み込んでおく)
+compiledScripts = {}
+
+def loadScript(fileName):
+	code = compiledScripts.get(fileName)
+	if code is None:
+		with open(fileName, 'rb') as f:
+			code = compile(f.read(), fileName, 'exec')
+		compiledScripts[fileName] = code
+	return code
+
+class Stage:
+	# chained が False の場合は、daemon.py・batch.py のように段としてつながずに1つだけ実行する
+	def __init__(self, argv, input=None, output=None, chained=True):
+		self.argv = argv
+		self.input = input
+		self.output = output
+		self.chained = chained
+
+local = threading.local()
+
+def current():
+	# 段として動いている場合はその Stage を、そうでなければ None を返す
+	return getattr(local, 'stage', None)
+
+def checkOptions(stage, usesInputFile, usesOutputFile, pipelined, statsSample):
+	# 段として動く場合に指定できないオプションを確認する
+	if stage is None or not stage.chained:
+		return
+	if stage.input is not None and usesInputFile:
+		raise Exception("input file and encoding can only be given to the first stage")
+	if stage.output is not None and usesOutputFile:
+		raise Exception("output file, encoding and compression level can only be given to the last stage")
+	if pipelined:
+		raise Exception("--pipelined cannot be used in a chain stage")
+	if statsSample is not None:
+		raise Exception("--stats-sample cannot be used in a chain stage")
+
+def typedParser(parse):
+	# 前の段から受け取った値は解析済みの数値の場合があるため、文字列のみ解析する
+	def parseTyped(v):
+		return parse(v) if type(v) is str else v
+	return parseTyped
+
+def runScript(fileName, stage):
+	# スクリプトを独立した名前空間で段として実行し、終了コードを返す
+	# runpy は実行中に sys.modules を置き換えるため、複数のスレッドから使えるよう exec で実行する
+	local.stage = stage
+	exitCode = 0
+	savedMain = sys.modules['__main__']
+	try:
+		if stage.chained:
+			namespace = {'__name__': '__main__', '__file__': fileName, '__builtins__': builtins}
+		else:
+			# プロセス内で1つだけ動くため __main__ として登録し、子プロセスに渡す関数を名前から引けるようにする
+			module = types.ModuleType('__main__')
+			module.__file__ = fileName
+			module.__builtins__ = builtins
+			namespace = module.__dict__
+			sys.modules['__main__'] = module
+		exec(loadScript(fileName), namespace)
+	except SystemExit as e:
+		if e.code is None:
+			exitCode = 0
+		elif isinstance(e.code, int):
+			exitCode = e.code
+		else:
+			sys.stderr.write(str(e.code) + '\n')
+			exitCode = 1
+	except StageStopped:
+		exitCode = 0
+	except PreviousStageFailed:
+		exitCode = 1
+	except BaseException:
+		traceback.print_exc()
+		exitCode = 1
+	finally:
+		sys.modules['__main__'] = savedMain
+		local.stage = None
+		if stage.input is not None:
+			stage.input.cancel()
+		if stage.output is not None:
+			stage.output.close(exitCode != 0)
+	return exitCode
@@ -0,0 +1,71 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import csv
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import column_reader
+
+def projectText(text, columns, encoding=None):
+	if encoding is None:
+		lines = io.StringIO(text, newline='').readlines()
+	else:
+		lines = io.BytesIO(text.encode(encoding)).readlines()
+	return list(column_reader.projectLines(lines, columns, encoding))
+
+class ProjectLinesTest(unittest.TestCase):
+	def test_stray_quote_in_unprojected_column(self):
+		text = '2020/01/01 00:00:00,1,5" screen\n2020/01/01 00:00:01,2,x\n2020/01/02 00:00:02,3,y\n'
+		for encoding in [None, 'utf-8']:
+			self.assertEqual(projectText(text, [0, 1], encoding), [
+				['2020/01/01 00:00:00', '1'],
+				['2020/01/01 00:00:01', '2'],
+				['2020/01/02 00:00:02', '3'],
+			])
+
+	def test_quoted_field_with_newline(self):
+		text = 'a,"x\ny""z",1\nb,"5"" screen",2\nc,5" screen,3\n'
+		expected = [[row[0], row[2], row[1]] for row in csv.reader(io.StringIO(text, newline=''))]
+		for encoding in [None, 'utf-8']:
+			self.assertEqual(projectText(text, [0, 2, 1], encoding), expected)
+
+	def test_skip_narrow_header_lines(self):
+		text = 'Title\ntime,"multi\nline"\n2020/01/01 00:00:00,1\n'
+		for encoding in [None, 'utf-8']:
+			if encoding is None:
+				lines = io.StringIO(text, newline='').readlines()
+			else:
+				lines = io.BytesIO(text.encode(encoding)).readlines()
+			lines = column_reader.skipLines(lines, 2, encoding)
+			self.assertEqual(list(column_reader.projectLines(lines, [1, 0], encoding)), [['1', '2020/01/01 00:00:00']])
+
+if __name__ == '__main__':
+	unittest.main()
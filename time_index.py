@@ -0,0 +1,115 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# 時刻の昇順に並んだ入力ファイルについて、一定の行数ごとの行の開始位置と時刻を
+# 入力ファイルの隣のファイル (入力ファイル名.tidx) に保存し、指定した時刻の行を探すのに使う
+
+import bisect
+import io
+import json
+import os
+
+import column_cache
+import column_reader
+
+indexSuffix = ".tidx"
+defaultInterval = 4096
+# ファイル内を二分探索する場合に、これより狭い範囲は先頭から順に読む
+searchBlockSize = 64 * 1024
+
+def indexFileName(inputFileName):
+	return inputFileName + indexSuffix
+
+def indexKey(inputFileName, encoding, headerNum, column, dateFormat):
+	return {
+		"source": column_cache.sourceInfo(inputFileName),
+		"encoding": encoding,
+		"header": headerNum,
+		"column": column,
+		"dateFormat": dateFormat,
+	}
+
+def buildIndex(inputFileName, key, begin, parseRecordTime, interval):
+	# begin 以降の interval 行ごとに [開始位置, 時刻] を記録する
+	# 行の区切りは column_reader.recordEnds で求め、記録する行のみを読み直して時刻を解析する
+	entries = []
+	with open(inputFileName, 'rb') as f, open(inputFileName, 'rb') as recordFile:
+		f.seek(begin)
+		start = begin
+		n = 0
+		for end in column_reader.recordEnds(f):
+			if n % interval == 0:
+				recordFile.seek(start)
+				entries.append([start, parseRecordTime(io.BytesIO(recordFile.read(end - start)).readlines())])
+			n += 1
+			start = end
+	tempFileName = indexFileName(inputFileName) + ".tmp"
+	with open(tempFileName, 'w') as f:
+		json.dump({"key": key, "interval": interval, "entries": entries}, f)
+	os.replace(tempFileName, indexFileName(inputFileName))
+	return entries
+
+def loadIndex(inputFileName, key):
+	# 入力ファイルや設定が変わっていない場合のみ、記録した [開始位置, 時刻] のリストを返す
+	try:
+		with open(indexFileName(inputFileName), 'r') as f:
+			index = json.load(f)
+		if index["key"] != key:
+			return None
+		return index["entries"]
+	except (OSError, ValueError, KeyError):
+		return None
+
+def findIndexedStart(entries, begin, fromTime):
+	# 時刻が fromTime より前の記録のうち最後のものの位置を返す (以降の行は先頭から順に読む)
+	k = bisect.bisect_left([entry[1] for entry in entries], fromTime)
+	return entries[k - 1][0] if k > 0 else begin
+
+def findStart(f, begin, end, fromTime, parseLineTime):
+	# インデックスがない場合に、ファイル内を二分探索して、時刻が fromTime より前の行の開始位置を返す
+	# 改行を含む列がないことを前提とし、時刻を解析できない行は飛ばす
+	low = begin
+	high = end
+	while high - low > searchBlockSize:
+		middle = (low + high) // 2
+		f.seek(middle)
+		f.readline()
+		lineStart = f.tell()
+		t = None
+		while lineStart < high:
+			line = f.readline()
+			if len(line) == 0:
+				break
+			try:
+				t = parseLineTime(line)
+				break
+			except (ValueError, IndexError):
+				lineStart += len(line)
+		if t is not None and lineStart < high and t < fromTime:
+			low = lineStart
+		else:
+			high = middle
+	return low
@@ -0,0 +1,113 @@
+#coding: utf-8
+
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 みけCAT
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# candle.py・copy_add_ma.py で共通の、数値の列の解析
+# 符号と数字・小数点のみからなる一般的な形は、文字の種類を調べて例外を使わずに解析し、
+# それ以外の形は int / float に任せる (結果は parseValueSlow と同じになる)
+# 価格などは同じ文字列が繰り返し現れるため、最近解析した文字列の結果を保存して使い回す
+
+import decimal
+
+# 解析結果を保存する文字列の数 (これを超えたら保存した結果を捨てて保存し直す)
+cacheSize = 65536
+
+def parseValueSlow(inStr):
+	ret = None
+	try:
+		ret = int(inStr)
+	except ValueError:
+		try:
+			ret = float(inStr)
+		except ValueError:
+			pass
+	return ret
+
+def parseValue(inStr):
+	if inStr.isdecimal():
+		return int(inStr)
+	body = inStr[1:] if inStr[:1] == '-' else inStr
+	if body.isdecimal():
+		return int(inStr)
+	whole, dot, fraction = body.partition('.')
+	if dot != '' and (whole != '' or fraction != '') and (whole == '' or whole.isdecimal()) and (fraction == '' or fraction.isdecimal()):
+		return float(inStr)
+	if inStr == '':
+		return None
+	return parseValueSlow(inStr)
+
+def cachedParser(parse):
+	# parse の結果を、引数の文字列ごとに保存して使い回す関数を返す
+	cache = {}
+	missing = cache
+
+	def parseCached(inStr):
+		ret = cache.get(inStr, missing)
+		if ret is missing:
+			ret = parse(inStr)
+			if len(cache) >= cacheSize:
+				cache.clear()
+			cache[inStr] = ret
+		return ret
+	return parseCached
+
+toValue = cachedParser(parseValue)
+
+class FixedPoint:
+	# 小数点以下の桁数が決まっている値を、10 ** decimals 倍した整数として扱う
+	# 浮動小数点数の誤差がなく、出力時は常に decimals 桁の小数として書き出す
+	def __init__(self, decimals):
+		self.decimals = decimals
+		self.scale = 10 ** decimals
+		self.toValue = cachedParser(self.parse)
+
+	def parse(self, inStr):
+		body = inStr[1:] if inStr[:1] == '-' else inStr
+		whole, dot, fraction = body.partition('.')
+		if (whole != '' or fraction != '') and (whole == '' or whole.isdecimal()) and (fraction == '' or fraction.isdecimal()):
+			if len(fraction) > self.decimals:
+				if fraction[self.decimals:].strip('0') != '':
+					raise Exception("value '{0}' has more than {1} decimal places".format(inStr, self.decimals))
+				fraction = fraction[:self.decimals]
+			ret = int(whole + fraction.ljust(self.decimals, '0'))
+			return -ret if body is not inStr else ret
+		# 指数表記などは Decimal で解析する
+		if parseValueSlow(inStr) is None:
+			return None
+		try:
+			scaled = decimal.Decimal(inStr.strip()).scaleb(self.decimals)
+			if scaled.is_finite() and scaled == scaled.to_integral_value():
+				return int(scaled)
+		except decimal.InvalidOperation:
+			pass
+		raise Exception("value '{0}' cannot be represented with {1} decimal places".format(inStr, self.decimals))
+
+	def format(self, value):
+		if type(value) is not int:
+			return value
+		if self.decimals == 0:
+			return str(value)
+		whole, fraction = divmod(abs(value), self.scale)
+		return '{0}{1}.{2:0{3}d}'.format('-' if value < 0 else '', whole, fraction, self.decimals)